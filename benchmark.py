@@ -0,0 +1,338 @@
+# Benchmarks for the Sakila bot data layer
+#
+# Runs against the databases configured in sakila.env.
+# Usage: python benchmark.py pool [--queries 200]
+#        python benchmark.py cache [--requests 5000] [--skew 1.1]
+#        python benchmark.py titles [--titles 100000] [--queries 200]
+#        python benchmark.py actors
+#        python benchmark.py warmstart
+#        python benchmark.py metrics [--calls 200000]
+#        python benchmark.py export [--rows 1000000]
+
+import argparse
+import asyncio
+import random
+import sqlite3
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import sakila_commands
+from sakila_cache import ResultCache
+from sakila_commands import EXPORT_COLUMNS, FilmRow
+from sakila_export import stream_rows, write_export
+from sakila_index import TrigramIndex
+from sakila_metrics import Metrics
+
+
+QUERY = "SELECT category_id, name FROM category;"
+
+
+def _report(name: str, timings: list):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{name:<12} mean {statistics.mean(timings) * 1000:7.2f} ms   "
+          f"p50 {statistics.median(timings) * 1000:7.2f} ms   p95 {p95 * 1000:7.2f} ms")
+
+
+# Per-query latency with a fresh connection per query vs. a pooled connection
+def bench_pool(queries: int):
+    timings = []
+    for _ in range(queries):
+        start = time.perf_counter()
+        connection = sakila_commands.connect_db()
+        cursor = connection.cursor()
+        cursor.execute(QUERY)
+        cursor.fetchall()
+        cursor.close()
+        connection.close()
+        timings.append(time.perf_counter() - start)
+    _report("no pool", timings)
+
+    sakila_commands.get_pool()  # Warm the pool up before measuring
+    timings = []
+    for _ in range(queries):
+        start = time.perf_counter()
+        with sakila_commands.get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(QUERY)
+            cursor.fetchall()
+            cursor.close()
+        timings.append(time.perf_counter() - start)
+    _report("pool", timings)
+
+
+# Zipfian sample of `count` requests over `keys` (rank 1 is the most popular)
+def zipf_requests(keys: list, count: int, skew: float) -> list:
+    weights = [1 / (rank ** skew) for rank in range(1, len(keys) + 1)]
+    return random.choices(keys, weights=weights, k=count)
+
+
+# Replaying a skewed workload of category and year pages with and without the result cache
+def bench_cache(requests: int, skew: float):
+    category_ids = [str(category.category_id) for category in sakila_commands.load_categories()]
+    keys = [('category', category_id) for category_id in category_ids]
+    keys += [('year', str(year)) for year in range(1990, 2026)]
+    random.shuffle(keys)
+    workload = zipf_requests(keys, requests, skew)
+
+    def replay(name: str):
+        timings = []
+        for kind, key in workload:
+            start = time.perf_counter()
+            if kind == 'category':
+                sakila_commands.movies_by_category_page(key)
+            else:
+                sakila_commands.movies_by_year_page(key)
+            timings.append(time.perf_counter() - start)
+        _report(name, timings)
+
+    sakila_commands.result_cache = ResultCache(0, 0, {})  # Every lookup misses
+    replay("no cache")
+
+    sakila_commands.result_cache = ResultCache(
+        sakila_commands.CACHE_MAX_ENTRIES, sakila_commands.CACHE_MAX_BYTES, sakila_commands.CACHE_TTLS
+    )
+    replay("cache")
+    stats = sakila_commands.result_cache.stats()
+    print(f"hit rate {stats['hit_rate']:.1%}, hits {stats['hits']}, misses {stats['misses']}, "
+          f"evictions {stats['evictions']}, {stats['bytes']} bytes in {stats['entries']} entries")
+
+
+# Synthetic Sakila-style titles: two random words, like "ACADEMY DINOSAUR"
+TITLE_WORDS = [
+    "ACADEMY", "ACE", "ADAPTATION", "AFFAIR", "AFRICAN", "AGENT", "AIRPLANE", "ALABAMA", "ALADDIN", "ALASKA",
+    "ALI", "ALIEN", "ALLEY", "AMADEUS", "AMELIE", "AMERICAN", "ANACONDA", "ANGELS", "ANNIE", "ANTHEM",
+    "APACHE", "APOCALYPSE", "ARABIA", "ARGONAUTS", "ARMAGEDDON", "ARMY", "ATLANTIS", "ATTACKS", "BABY", "BACKLASH",
+    "BADMAN", "BAKED", "BALLOON", "BANG", "BANGER", "BAREFOOT", "BASIC", "BEACH", "BEAR", "BEAST",
+    "BEAUTY", "BEDAZZLED", "BEHAVIOR", "BENEATH", "BERETS", "BETRAYED", "BEVERLY", "BIKINI", "BILKO", "BIRCH",
+    "DINOSAUR", "GOLDFINGER", "SECRETARY", "SUSPECTS", "HOLES", "EGG", "DOCTOR", "DRIVER", "GRAFFITI", "WAKE",
+]
+
+
+def synthetic_titles(count: int) -> list:
+    return [
+        FilmRow(film_id, f"{random.choice(TITLE_WORDS)} {random.choice(TITLE_WORDS)}", 2006)
+        for film_id in range(1, count + 1)
+    ]
+
+
+# Trigram index lookups vs. LIKE '%...%' scans over an enlarged film table in SQLite
+# Sakila titles and misspelled searches for them, with the title word each search means
+TYPO_TITLES = ["ACADEMY DINOSAUR", "AGENT TRUMAN", "GOLDFINGER SENSIBILITY", "ALADDIN CALENDAR", "CHAMBER ITALIAN"]
+TYPO_SEARCHES = [("dinosuar", "dinosaur"), ("trumen", "truman"), ("goldfnger", "goldfinger"), ("aladin", "aladdin"),
+                 ("italain", "italian"), ("academy dinosuar", "dinosaur"), ("agent trumen", "truman")]
+
+
+def bench_titles(titles: int, queries: int):
+    rows = synthetic_titles(titles)
+    rows += [FilmRow(len(rows) + i, title, 2006) for i, title in enumerate(TYPO_TITLES, 1)]
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE film (film_id INTEGER PRIMARY KEY, title TEXT, release_year INTEGER)")
+    connection.executemany("INSERT INTO film VALUES (?, ?, ?)", rows)
+    connection.execute("CREATE INDEX idx_title ON film (title)")
+
+    start = time.perf_counter()
+    index = TrigramIndex(rows)
+    print(f"index build {time.perf_counter() - start:.2f} s for {len(index)} titles")
+
+    searches = [random.choice(TITLE_WORDS)[1:5].lower() for _ in range(queries)]
+
+    timings = []
+    for text in searches:
+        start = time.perf_counter()
+        connection.execute("SELECT film_id, title, release_year FROM film WHERE title LIKE ?", (f"%{text}%",)).fetchall()
+        timings.append(time.perf_counter() - start)
+    _report("LIKE scan", timings)
+
+    timings = []
+    for text in searches:
+        start = time.perf_counter()
+        index.search(text)
+        timings.append(time.perf_counter() - start)
+    _report("trigram", timings)
+    connection.close()
+
+    # A misspelled word must still bring up titles with the word it means, first
+    timings = []
+    found = 0
+    for text, word in TYPO_SEARCHES:
+        start = time.perf_counter()
+        matches = index.search(text, limit=10)
+        timings.append(time.perf_counter() - start)
+        if matches and word in matches[0].title.lower():
+            found += 1
+        else:
+            print(f"typo {text!r}: {matches[0].title if matches else 'nothing'} instead of a title with {word!r}")
+    _report("typos", timings)
+    print(f"{found} of {len(TYPO_SEARCHES)} misspelled searches found the title they meant")
+
+
+# Actor index lookups vs. the LIKE query actors_by_name_page() falls back to without the index,
+# and a check that the index finds every SQL match
+def bench_actors():
+    sakila_commands.load_catalog()
+    index = sakila_commands.actor_index
+    searches = sorted({name.lower() for row in index.rows.values() for name in (row.first_name, row.last_name)})
+    searches += [name[1:4] for name in searches]
+
+    timings = []
+    sql_results = {}
+    sakila_commands.actor_index = None
+    try:
+        for text in searches:
+            sakila_commands.result_cache.invalidate()
+            start = time.perf_counter()
+            sql_results[text], _ = sakila_commands.actors_by_name_page(text, 0, len(index.rows))
+            timings.append(time.perf_counter() - start)
+    finally:
+        sakila_commands.actor_index = index
+    _report("SQL LIKE", timings)
+
+    timings = []
+    missing = 0
+    for text in searches:
+        start = time.perf_counter()
+        found = index.search_ids(text)
+        timings.append(time.perf_counter() - start)
+        missing += len({row.actor_id for row in sql_results[text]} - set(found))
+    _report("index", timings)
+    print(f"{len(searches)} searches, {missing} SQL matches missing from the index")
+
+
+# Time to the first movie details answer through main.start_services, the bot's startup path:
+# a cold start loading the catalog from MySQL vs. a warm start from the snapshot
+def bench_warmstart():
+    import main  # Only this benchmark needs the bot module
+
+    async def first_response(name: str) -> tuple:
+        sakila_commands.film_catalog = sakila_commands.actor_index = sakila_commands.actor_films = None
+        sakila_commands.title_index = None
+        start = time.perf_counter()
+        tasks, metrics_server = await main.start_services(0)
+        sakila_commands.movie_by_id("1")
+        print(f"{name:<12} {(time.perf_counter() - start) * 1000:8.1f} ms to first response")
+        for task in tasks:
+            task.cancel()
+        return tasks, metrics_server
+
+    async def run():
+        # A snapshot file of its own, so the cold start really has none
+        fd, sakila_commands.SNAPSHOT_PATH = tempfile.mkstemp(suffix=".snapshot")
+        os.close(fd)
+        os.remove(sakila_commands.SNAPSHOT_PATH)
+        try:
+            await first_response("MySQL")  # Also writes the snapshot
+            services = await first_response("snapshot")
+            await main.stop_services(services)
+        finally:
+            if os.path.exists(sakila_commands.SNAPSHOT_PATH):
+                os.remove(sakila_commands.SNAPSHOT_PATH)
+
+    asyncio.run(run())
+
+
+# Cost of the timing layer: a no-op handler with and without metrics.timed, and a bare observe()
+def bench_metrics(calls: int):
+    metrics = Metrics()
+
+    async def handler():
+        pass
+
+    async def replay(func) -> float:
+        start = time.perf_counter()
+        for _ in range(calls):
+            await func()
+        return time.perf_counter() - start
+
+    plain = asyncio.run(replay(handler))
+    timed = asyncio.run(replay(metrics.timed("handler", handler)))
+    start = time.perf_counter()
+    for _ in range(calls):
+        metrics.observe("sql", "category", 0.002)
+    observe = time.perf_counter() - start
+
+    print(f"plain handler  {plain / calls * 1e9:8.0f} ns per call")
+    print(f"timed handler  {timed / calls * 1e9:8.0f} ns per call ({(timed - plain) / calls * 1e9:.0f} ns added)")
+    print(f"observe()      {observe / calls * 1e9:8.0f} ns per call")
+
+
+# Peak Python memory of exporting a synthetic film table (SQLite): fetchall() vs. streaming with fetchmany()
+def bench_export(rows: int):
+    file = tempfile.NamedTemporaryFile(suffix=".sqlite", delete=False)
+    file.close()
+    path = file.name
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE film (film_id INTEGER PRIMARY KEY, title TEXT, release_year INTEGER, "
+                       "category TEXT, length INTEGER, rating TEXT)")
+    titles = [film.title for film in synthetic_titles(1000)]
+    connection.executemany("INSERT INTO film VALUES (?, ?, ?, ?, ?, ?)", (
+        (film_id, titles[film_id % len(titles)], 1990 + film_id % 36, "Documentary", 46 + film_id % 140, "PG-13")
+        for film_id in range(1, rows + 1)
+    ))
+    connection.commit()
+
+    def measure(name: str, export):
+        cursor = connection.execute("SELECT * FROM film ORDER BY film_id")
+        with tempfile.TemporaryFile() as file:
+            tracemalloc.start()
+            start = time.perf_counter()
+            count = export(cursor, file)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            size = file.tell()
+        print(f"{name:<14} {count} rows in {elapsed:6.1f} s, peak {peak / 1024 / 1024:8.1f} MiB, "
+              f"{size / 1024 / 1024:.1f} MiB gzip")
+
+    try:
+        for fmt in ("csv", "jsonl"):
+            measure(f"fetchall {fmt}", lambda cursor, file: write_export(file, EXPORT_COLUMNS, cursor.fetchall(), fmt))
+            measure(f"stream {fmt}", lambda cursor, file: write_export(file, EXPORT_COLUMNS, stream_rows(cursor), fmt))
+    finally:
+        connection.close()
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sakila bot benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    pool_parser = subparsers.add_parser("pool", help="Connection per query vs. connection pool")
+    pool_parser.add_argument("--queries", type=int, default=200)
+
+    cache_parser = subparsers.add_parser("cache", help="Zipfian replay with and without the result cache")
+    cache_parser.add_argument("--requests", type=int, default=5000)
+    cache_parser.add_argument("--skew", type=float, default=1.1)
+
+    titles_parser = subparsers.add_parser("titles", help="Trigram title index vs. LIKE scans")
+    titles_parser.add_argument("--titles", type=int, default=100000)
+    titles_parser.add_argument("--queries", type=int, default=200)
+
+    subparsers.add_parser("actors", help="Actor name index vs. SQL LIKE, with a correctness check")
+
+    subparsers.add_parser("warmstart", help="Time to first response with and without the snapshot")
+
+    metrics_parser = subparsers.add_parser("metrics", help="Overhead of the handler and query timings")
+    metrics_parser.add_argument("--calls", type=int, default=200000)
+
+    export_parser = subparsers.add_parser("export", help="Peak memory of fetchall vs. streaming export")
+    export_parser.add_argument("--rows", type=int, default=1000000)
+
+    args = parser.parse_args()
+    if args.benchmark == "pool":
+        bench_pool(args.queries)
+    elif args.benchmark == "cache":
+        bench_cache(args.requests, args.skew)
+    elif args.benchmark == "titles":
+        bench_titles(args.titles, args.queries)
+    elif args.benchmark == "actors":
+        bench_actors()
+    elif args.benchmark == "warmstart":
+        bench_warmstart()
+    elif args.benchmark == "metrics":
+        bench_metrics(args.calls)
+    elif args.benchmark == "export":
+        bench_export(args.rows)
@@ -0,0 +1,829 @@
+# Handler load test: replays synthetic updates through every handler in main.py
+#
+# Runs fully offline: the data layer reads a generated Sakila-like SQLite database,
+# counters and leaderboards stay in memory (no MongoDB writes on the request path),
+# and Bot API calls are answered locally instead of going to Telegram.
+#
+# Usage: python load_test.py [--requests 500] [--concurrency 20] [--films 1000] [--handlers help,title_search]
+#        python load_test.py --coalescing [--callers 100]
+#        python load_test.py --isolation [--callers 100]
+#        python load_test.py --slow-backend [--delay 0.2]
+#        python load_test.py --refresh
+#        python load_test.py --mongo [--callers 100]   (needs mongomock)
+#        python load_test.py --rate-limit [--chats 20] [--per-chat 5] [--exports 10]
+#        python load_test.py --state [--users 200]
+#        python load_test.py --workers 1,2,4 [--users 200] [--requests 500] [--films 20000]   (needs mongomock)
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+import main
+import sakila_commands
+from benchmark import TITLE_WORDS
+from sakila_ratelimit import SendScheduler, TokenBucket
+from sakila_state import SQLiteStateStore, StatePersistence, decode_state
+from sakila_workers import WorkerPool
+from webhook_harness import FakeBotAPI, api_result, percentile
+
+
+CATEGORY_NAMES = ["Action", "Animation", "Children", "Classics", "Comedy", "Documentary", "Drama", "Family",
+                  "Foreign", "Games", "Horror", "Music", "New", "Sci-Fi", "Sports", "Travel"]
+FIRST_NAMES = ["PENELOPE", "NICK", "ED", "JENNIFER", "JOHNNY", "BETTE", "GRACE", "MATTHEW", "JOE", "CHRISTIAN"]
+LAST_NAMES = ["GUINESS", "WAHLBERG", "CHASE", "DAVIS", "LOLLOBRIGIDA", "NICHOLSON", "MOSTEL", "JOHANSSON", "SWANK", "GABLE"]
+RATINGS = ["G", "PG", "PG-13", "R", "NC-17"]
+
+
+# Sakila-like SQLite database with the tables and columns the data layer reads
+def build_sqlite_fixture(path: str, films: int, actors: int):
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE category (category_id INTEGER PRIMARY KEY, name TEXT, last_update TEXT);
+        CREATE TABLE film (film_id INTEGER PRIMARY KEY, title TEXT, description TEXT, release_year INTEGER,
+                           length INTEGER, rating TEXT, last_update TEXT);
+        CREATE TABLE film_category (film_id INTEGER, category_id INTEGER, last_update TEXT,
+                                    PRIMARY KEY (film_id, category_id));
+        CREATE TABLE actor (actor_id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, last_update TEXT);
+        CREATE TABLE film_actor (actor_id INTEGER, film_id INTEGER, last_update TEXT, PRIMARY KEY (actor_id, film_id));
+        CREATE INDEX idx_release_year ON film (release_year, film_id);
+        CREATE INDEX idx_fk_category_id ON film_category (category_id);
+        CREATE INDEX idx_fk_film_id ON film_actor (film_id);
+    """)
+    now = "2006-02-15 05:03:42"
+    connection.executemany("INSERT INTO category VALUES (?, ?, ?)",
+                           [(i, name, now) for i, name in enumerate(CATEGORY_NAMES, 1)])
+    connection.executemany("INSERT INTO film VALUES (?, ?, ?, ?, ?, ?, ?)", [
+        (film_id, f"{random.choice(TITLE_WORDS)} {random.choice(TITLE_WORDS)}", "A synthetic film",
+         random.randint(1990, 2025), random.randint(46, 185), random.choice(RATINGS), now)
+        for film_id in range(1, films + 1)
+    ])
+    connection.executemany("INSERT INTO film_category VALUES (?, ?, ?)",
+                           [(film_id, random.randint(1, len(CATEGORY_NAMES)), now) for film_id in range(1, films + 1)])
+    connection.executemany("INSERT INTO actor VALUES (?, ?, ?, ?)",
+                           [(i, random.choice(FIRST_NAMES), random.choice(LAST_NAMES), now) for i in range(1, actors + 1)])
+    connection.executemany("INSERT OR IGNORE INTO film_actor VALUES (?, ?, ?)", [
+        (random.randint(1, actors), film_id, now) for film_id in range(1, films + 1) for _ in range(5)
+    ])
+    connection.commit()
+    connection.close()
+
+
+# mysql.connector-style connection over SQLite: %s placeholders, NOW() - INTERVAL and the sakila. schema prefix.
+# delay: seconds every statement blocks its thread, like a slow database server
+class _SQLiteConnection:
+    def __init__(self, connection, delay: float = 0.0):
+        self.connection = connection
+        self.delay = delay
+
+    def cursor(self):
+        return _SQLiteCursor(self.connection.cursor(), self.delay)
+
+    def commit(self):
+        self.connection.commit()
+
+
+class _SQLiteCursor:
+    def __init__(self, cursor, delay: float = 0.0):
+        self.cursor = cursor
+        self.delay = delay
+
+    def execute(self, query: str, params: tuple = ()):
+        if self.delay:
+            time.sleep(self.delay)
+        query = query.replace("NOW() - INTERVAL %s SECOND", "datetime('now', (-%s) || ' seconds')")
+        self.cursor.execute(query.replace("%s", "?").replace("sakila.", ""), params)
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchmany(self, size: int):
+        return self.cursor.fetchmany(size)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def close(self):
+        self.cursor.close()
+
+
+# Path of a new empty file for a test database; unlike mktemp, no other process can take the name
+def _temp_path(suffix: str) -> str:
+    file = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+    file.close()
+    return file.name
+
+
+# Pointing the data layer at the SQLite fixture instead of the MySQL pool
+def use_sqlite_fixture(path: str):
+    @contextmanager
+    def get_connection():
+        connection = sqlite3.connect(path)
+        try:
+            yield _SQLiteConnection(connection)
+        finally:
+            connection.close()
+
+    sakila_commands.get_connection = get_connection
+
+
+# Bot API requests answered in-process, so handlers run without Telegram
+class LocalRequest(BaseRequest):
+    def __init__(self, replies: list = None):
+        self.replies = replies  # (chat_id, text) of every message sent, when given
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        params = request_data.parameters if request_data is not None else {}
+        result = api_result(url.rsplit("/", 1)[-1], params)
+        if self.replies is not None and "text" in params:
+            self.replies.append((int(params.get("chat_id", 0)), params["text"]))
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def build_application(persistence=None, replies: list = None) -> Application:
+    builder = Application.builder().token("123456:LOAD-TEST").request(LocalRequest(replies)).get_updates_request(LocalRequest())
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    app = builder.build()
+    main.add_handlers(app)
+    return app
+
+
+_update_ids = iter(range(1, 10 ** 9))
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": "Load"}
+
+
+def message_update(user_id: int, text: str) -> dict:
+    message = {
+        "message_id": next(_update_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": next(_update_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Sakila"},
+                "text": "menu",
+            },
+        },
+    }
+
+
+# Scenario name -> (search mode set up first or None, function building the update for user i)
+def scenarios() -> dict:
+    categories = [category.category_id for category in sakila_commands.get_categories()]
+    films = list(sakila_commands.film_catalog.films.values())
+    actors = list(sakila_commands.actor_index.rows.values())
+
+    def category_next(user_id: int) -> str:
+        category_id = random.choice(categories)
+        page = sakila_commands.movies_by_category_page(category_id, limit=main.MOVIES_PER_PAGE)
+        if not page:
+            return f"cat_{category_id}_page_0"
+        last = main.encode_cursor(page[-1].release_year, page[-1].film_id)
+        return f"cat_{category_id}_next_1_{last}"
+
+    def year_next(user_id: int) -> str:
+        year = random.randint(1990, 2025)
+        page = sakila_commands.movies_by_year_page(year, limit=main.MOVIES_PER_PAGE)
+        if not page:
+            return f"year_{year}"
+        last = main.encode_cursor(page[-1].category, page[-1].film_id)
+        return f"year_{year}_next_0_{last}"
+
+    return {
+        "start": (None, lambda i: message_update(i, "/start")),
+        "help": (None, lambda i: message_update(i, "/help")),
+        "keyword": (None, lambda i: message_update(i, "/keyword")),
+        "button_keyword": (None, lambda i: callback_update(i, random.choice(["title", "actor"]))),
+        "category": (None, lambda i: message_update(i, "/category")),
+        "button_category": (None, lambda i: callback_update(i, f"cat_{random.choice(categories)}_page_0")),
+        "button_category_next": (None, lambda i: callback_update(i, category_next(i))),
+        "release": (None, lambda i: message_update(i, "/release")),
+        "button_release": (None, lambda i: callback_update(i, f"year_{random.randint(1990, 2025)}")),
+        "button_release_next": (None, lambda i: callback_update(i, year_next(i))),
+        "button_release_grid": (None, lambda i: callback_update(i, f"next_{random.randint(0, 2)}")),
+        "queries": (None, lambda i: message_update(i, "/queries")),
+        "button_query": (None, lambda i: callback_update(
+            i, random.choice(["query_movies", "query_actors", "query_category", "query_year"]))),
+        "title_search": ("title", lambda i: message_update(i, random.choice(TITLE_WORDS)[:4].lower())),
+        "movie_id": ("title", lambda i: message_update(i, str(random.choice(films).film_id))),
+        "actor_search": ("actor", lambda i: message_update(i, random.choice(FIRST_NAMES + LAST_NAMES).lower())),
+        "actor_id": ("actor", lambda i: message_update(i, str(random.choice(actors).actor_id))),
+        "export": (None, lambda i: message_update(i, f"/export category {random.choice(categories)} csv")),
+        "button_search": (None, lambda i: callback_update(i, f"find_films_{random.choice(actors).actor_id}_1")),
+    }
+
+
+async def run_scenario(app: Application, mode, make_update, requests: int, concurrency: int) -> tuple:
+    users = [100000 + i for i in range(concurrency)]
+    if mode is not None:
+        # Switch every simulated user into the search mode first, like pressing /keyword
+        for user_id in users:
+            await app.process_update(Update.de_json(callback_update(user_id, mode), app.bot))
+
+    updates = [Update.de_json(make_update(users[i % concurrency]), app.bot) for i in range(requests)]
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+
+    async def process(update: Update):
+        async with semaphore:
+            start = time.perf_counter()
+            await app.process_update(update)
+            timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(process(update) for update in updates))
+    return sorted(timings), time.perf_counter() - start
+
+
+def _sql_calls() -> dict:
+    return {label: histogram.count for metric, label, histogram in sakila_commands.metrics.snapshot() if metric == "sql"}
+
+
+# The same category button tapped by `callers` users at once, with nothing cached:
+# the page and count queries must each reach the database exactly once
+async def check_coalescing(app: Application, callers: int) -> bool:
+    sakila_commands.result_cache.invalidate()
+    sakila_commands.metrics.reset()
+    calls, collapsed = sakila_commands.coalescer.calls, sakila_commands.coalescer.collapsed
+    category_id = sakila_commands.get_categories()[0].category_id
+    updates = [Update.de_json(callback_update(100000 + i, f"cat_{category_id}_page_0"), app.bot) for i in range(callers)]
+    await asyncio.gather(*(app.process_update(update) for update in updates))
+
+    queries = _sql_calls()
+    print(f"{callers} identical callbacks: {queries.get('category', 0)} page queries, {queries.get('count', 0)} count queries, "
+          f"{sakila_commands.coalescer.calls - calls} coalesced calls ran, "
+          f"{sakila_commands.coalescer.collapsed - collapsed} callers shared a running call")
+    return queries.get('category', 0) == 1 and queries.get('count', 0) == 1
+
+
+# Every user taps a category or a year button at the same moment; each reply must list the rows
+# of that user's own category or year, read straight from the database for comparison
+async def check_isolation(callers: int) -> bool:
+    replies = []
+    app = build_application(replies=replies)
+    await app.initialize()
+    sakila_commands.result_cache.invalidate()
+    categories = sakila_commands.get_categories()
+    category_query = """SELECT film.film_id, title, release_year FROM film JOIN film_category ON film.film_id = film_category.film_id
+                        WHERE category_id = %s ORDER BY release_year, film.film_id LIMIT %s"""
+    year_query = """SELECT film.film_id, title, category.name FROM film JOIN film_category ON film.film_id = film_category.film_id
+                    JOIN category ON film_category.category_id = category.category_id
+                    WHERE release_year = %s ORDER BY category.name, film.film_id LIMIT %s"""
+
+    expected = {}  # chat_id -> (header, rows)
+    updates = []
+    for i in range(callers):
+        user_id = 100000 + i
+        if i % 2 == 0:
+            category = categories[i // 2 % len(categories)]
+            rows = [sakila_commands.FilmRow(*row) for row in sakila_commands.fetch_all(category_query, (category.category_id, main.MOVIES_PER_PAGE))]
+            expected[user_id] = (f'"{category.name}"', rows)
+            updates.append(callback_update(user_id, f"cat_{category.category_id}_page_0"))
+        else:
+            year = 1990 + i // 2 % 36
+            rows = [sakila_commands.FilmCategoryRow(*row) for row in sakila_commands.fetch_all(year_query, (year, main.MOVIES_PER_PAGE))]
+            expected[user_id] = (f"released in {year}", rows)
+            updates.append(callback_update(user_id, f"year_{year}"))
+
+    await asyncio.gather(*(app.process_update(Update.de_json(update, app.bot)) for update in updates))
+    await app.shutdown()
+
+    received = {}
+    for chat_id, text in replies:
+        received.setdefault(chat_id, []).append(text)
+    wrong = 0
+    for user_id, (header, rows) in expected.items():
+        texts = received.get(user_id, [])
+        if len(texts) != 1 or header not in texts[0] or any(str(row) not in texts[0] for row in rows):
+            wrong += 1
+    print(f"{callers} concurrent category and year taps: {callers - wrong} users got their own results, {wrong} did not")
+    return wrong == 0
+
+
+# Users tapping different categories while every SQL statement takes `delay` seconds. The queries
+# run on the database threads, so users up to DB_WORKERS finish in about the time of one user;
+# blocking the event loop would make it `users` times that
+async def check_slow_backend(delay: float) -> bool:
+    users = sakila_commands.DB_WORKERS
+    app = build_application()
+    await app.initialize()
+    sakila_commands.result_cache.invalidate()
+    fast_connection = sakila_commands.get_connection
+
+    @contextmanager
+    def slow_connection():
+        with fast_connection() as connection:
+            connection.delay = delay
+            yield connection
+
+    sakila_commands.get_connection = slow_connection
+    threshold, sakila_commands.slow_queries.threshold = sakila_commands.slow_queries.threshold, float("inf")  # no EXPLAIN runs
+    categories = [category.category_id for category in sakila_commands.get_categories()]
+
+    async def tap(user_id: int, category_id: int) -> float:
+        start = time.perf_counter()
+        await app.process_update(Update.de_json(callback_update(user_id, f"cat_{category_id}_page_0"), app.bot))
+        return time.perf_counter() - start
+
+    one_user = await tap(100000, categories[0])
+    start = time.perf_counter()
+    await asyncio.gather(*(tap(100001 + i, categories[1 + i]) for i in range(users)))
+    all_users = time.perf_counter() - start
+    sakila_commands.get_connection = fast_connection
+    sakila_commands.slow_queries.threshold = threshold
+    await app.shutdown()
+
+    print(f"one user         {one_user * 1000:7.0f} ms ({delay * 1000:.0f} ms per statement)")
+    print(f"{users} users at once {all_users * 1000:7.0f} ms (one after another: about {one_user * users * 1000:.0f} ms)")
+    return all_users < one_user * 1.5
+
+
+# Catalog refresh against edits made to the fixture: idle polls must read no rows at all (every
+# fixture row shares one last_update second), and a renamed category, a retitled film, a new actor
+# with a film, a new actor stamped with the seed second, and a late commit into the current second
+# with a lower key than a row already applied must all reach the in-memory catalog
+async def check_refresh() -> bool:
+    delta_queries = set(sakila_commands.DELTA_QUERIES.values()) | set(sakila_commands.DELTA_RECENT_QUERIES.values())
+    fetch_all = sakila_commands.fetch_all
+    delta_rows = 0
+
+    def counting_fetch_all(query, params=(), kind=None):
+        nonlocal delta_rows
+        rows = fetch_all(query, params, kind)
+        if query in delta_queries:
+            delta_rows += len(rows)
+        return rows
+
+    def idle_polls(polls: int) -> bool:
+        nonlocal delta_rows
+        delta_rows = 0
+        changed = [sakila_commands.refresh_catalog() for _ in range(polls)]
+        return not any(changed) and delta_rows == 0
+
+    def edit(*statements):
+        with sakila_commands.get_connection() as connection:
+            cursor = connection.cursor()
+            for query, params in statements:
+                cursor.execute(query, params)
+            connection.commit()
+            cursor.close()
+
+    sakila_commands.fetch_all = counting_fetch_all
+    try:
+        idle_before = idle_polls(3)
+        seed_second = fetch_all("SELECT MAX(last_update) FROM actor;")[0][0]
+        actor_id = fetch_all("SELECT MAX(actor_id) FROM actor;")[0][0] + 1
+        later = "2020-06-01 12:00:00"
+        edit(("UPDATE category SET name = %s, last_update = %s WHERE category_id = 1;", ("Action & Adventure", later)),
+             ("UPDATE film SET title = %s, last_update = %s WHERE film_id = 1;", ("REFRESHED FILM", later)),
+             ("INSERT INTO actor VALUES (%s, %s, %s, %s);", (actor_id, "GRETA", "REFRESHMAN", later)),
+             ("INSERT INTO film_actor VALUES (%s, %s, %s);", (actor_id, 1, later)),
+             ("INSERT INTO actor VALUES (%s, %s, %s, %s);", (actor_id + 1, "OTTO", "SAMESECOND", seed_second)))
+
+        delta_rows = 0
+        changed = sakila_commands.refresh_catalog()
+        applied_rows = delta_rows
+        idle_after = idle_polls(3)
+
+        # A row of the current second is applied, then a transaction that started in the same
+        # second commits a row with a lower key
+        now_second = fetch_all("SELECT NOW() - INTERVAL %s SECOND;", (0,))[0][0]
+        edit(("INSERT INTO actor VALUES (%s, %s, %s, %s);", (actor_id + 2, "NORA", "HIGHKEY", now_second)))
+        sakila_commands.refresh_catalog()
+        edit(("UPDATE actor SET last_name = %s, last_update = %s WHERE actor_id = 1;", ("LATECOMMIT", now_second)))
+        sakila_commands.refresh_catalog()
+    finally:
+        sakila_commands.fetch_all = fetch_all
+
+    catalog = sakila_commands.film_catalog
+    results = {
+        "renamed category listed": "Action & Adventure" in [category.name for category in sakila_commands.get_categories()],
+        "films of the renamed category": all(film.category_name == "Action & Adventure"
+                                             for film in catalog.films.values() if film.category_id == 1),
+        "retitled film": catalog.get(1).title == "REFRESHED FILM",
+        "retitled film searchable": any(row.film_id == 1 for row in sakila_commands.movies_by_title_page("refreshed")[0]),
+        "new actor searchable": any(row.actor_id == actor_id for row in sakila_commands.actors_by_name_page("refreshman")[0]),
+        "new actor's film": 1 in sakila_commands.actor_films.get(actor_id, ()),
+        "actor at the seed second": any(row.actor_id == actor_id + 1 for row in sakila_commands.actors_by_name_page("samesecond")[0]),
+        "late commit, lower key": sakila_commands.actor_index.rows[1].last_name == "LATECOMMIT",
+    }
+    print(f"idle polls before edits  {'no rows read' if idle_before else 'rows re-read'}")
+    print(f"refresh after edits      {applied_rows} rows read, changed tables: {', '.join(changed)}")
+    for name, passed in results.items():
+        print(f"{name:<30} {'ok' if passed else 'MISSING'}")
+    print(f"idle polls after edits   {'no rows read' if idle_after else 'rows re-read'}")
+    return idle_before and idle_after and applied_rows == 5 and all(results.values())
+
+
+# Pointing the query counters and leaderboards at mongomock, an in-process MongoDB stand-in.
+# False when mongomock is not installed
+def use_mongomock() -> bool:
+    try:
+        import mongomock
+        from mongomock.collection import BulkOperationBuilder
+    except ImportError:
+        return False
+    if "sort" not in inspect.signature(BulkOperationBuilder.add_update).parameters:
+        # pymongo >= 4.11 passes UpdateOne's sort (None here) to the bulk builder; mongomock 4.3 predates it
+        add_update = BulkOperationBuilder.add_update
+        BulkOperationBuilder.add_update = lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs)
+    os.environ.setdefault("MONGO_DB", "sakila_queries")
+    sakila_commands._mongo_client = mongomock.MongoClient()
+    return True
+
+
+# Query counters against mongomock, an in-process MongoDB stand-in: the indexes exist, `callers`
+# threads counting the same new category at once leave one document with the full count,
+# a duplicate key is rejected by the unique index, and the leaderboards agree with MongoDB
+# (check_leaderboards) until another writer changes a count behind their back
+def check_mongo(callers: int) -> bool:
+    if not use_mongomock():
+        print("--mongo needs mongomock: pip install mongomock")
+        return False
+    from pymongo.errors import DuplicateKeyError
+    db = sakila_commands.connect_mongo()
+    sakila_commands.ensure_mongo_indexes()
+
+    indexed = all(
+        any(info["key"] == [(key, 1)] and info.get("unique") for info in db[name].index_information().values())
+        and any(info["key"] == [("count", -1)] for info in db[name].index_information().values())
+        for name, key in sakila_commands.MONGO_KEYS.items()
+    )
+
+    # First hits racing on direct upserts, then on the write-behind buffer
+    barrier = threading.Barrier(callers)
+
+    def first_hit():
+        barrier.wait()
+        sakila_commands._write_counters({"category": [(7, 1, {"category_name": "Drama"})]})
+
+    def buffered_hit():
+        barrier.wait()
+        sakila_commands.insert_year(2006)
+
+    for target in (first_hit, buffered_hit):
+        threads = [threading.Thread(target=target) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    sakila_commands.query_counters.flush()
+
+    category_docs = list(db["category"].find({"category_id": 7}))
+    year_docs = list(db["year"].find({"release_year": 2006}))
+    try:
+        db["category"].insert_one({"category_id": 7, "count": 1})
+        duplicate_rejected = False
+    except DuplicateKeyError:
+        duplicate_rejected = True
+
+    # Leaderboards seeded from MongoDB like at startup, then counting clicks of their own
+    sakila_commands.load_leaderboards()
+    for i in range(callers):
+        sakila_commands.insert_category(1 + i % 16, f"Category {1 + i % 16}")
+        sakila_commands.insert_year(1990 + i % 12)
+    consistent = sakila_commands.check_leaderboards()
+    db["year"].update_one({"release_year": 2006}, {"$inc": {"count": 5}})
+    drifted = sakila_commands.check_leaderboards()
+
+    print(f"indexes        {'unique key and count index on every collection' if indexed else 'missing'}")
+    print(f"direct upserts {len(category_docs)} document(s), count {category_docs[0]['count'] if category_docs else 0} of {callers}")
+    print(f"buffered       {len(year_docs)} document(s), count {year_docs[0]['count'] if year_docs else 0} of {callers}")
+    print(f"duplicate key  {'rejected' if duplicate_rejected else 'accepted'}")
+    print(f"leaderboards   {len(consistent)} differences from MongoDB, {len(drifted)} after an outside write")
+    return (indexed and duplicate_rejected and not consistent and drifted and len(category_docs) == len(year_docs) == 1
+            and category_docs[0]["count"] == year_docs[0]["count"] == callers)
+
+
+# A burst of /help replies from `chats` users plus bulk /export documents against the fake
+# Bot API enforcing flood limits, first sent straight through, then through the send scheduler
+async def check_rate_limits(chats: int, per_chat: int, exports: int) -> bool:
+    api = FakeBotAPI(("127.0.0.1", 0), limits=(30, 1, 3))
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{api.server_address[1]}/bot"
+    categories = [category.category_id for category in sakila_commands.get_categories()]
+
+    delivered = {}
+    for name, scheduler in (("direct", None), ("scheduler", SendScheduler(overall_rate=25, overall_burst=25))):
+        api.overall = TokenBucket(30, 30)
+        api.chats = {}
+        api.replies = []
+        api.rejected = 0
+        builder = Application.builder().token("123456:LOAD-TEST").base_url(base_url)
+        if scheduler is not None:
+            builder = builder.rate_limiter(scheduler)
+        app = builder.build()
+        main.add_handlers(app)
+        await app.initialize()
+
+        updates = [("interactive", message_update(100000 + chat, "/help")) for chat in range(chats) for _ in range(per_chat)]
+        updates += [("bulk", message_update(100000 + i % chats, f"/export category {random.choice(categories)} csv"))
+                    for i in range(exports)]
+        random.shuffle(updates)
+        timings = {"interactive": [], "bulk": []}
+
+        async def process(kind: str, update: dict):
+            start = time.perf_counter()
+            await app.process_update(Update.de_json(update, app.bot))
+            timings[kind].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(process(kind, update) for kind, update in updates))
+        elapsed = time.perf_counter() - start
+        await app.shutdown()
+
+        delivered[name] = len(api.replies)
+        retries = scheduler.retries if scheduler is not None else 0
+        print(f"{name:<10} {len(api.replies)}/{len(updates)} delivered in {elapsed:.1f} s, "
+              f"{api.rejected} rejected with 429, {retries} retried")
+        for kind, values in timings.items():
+            values.sort()
+            if values:
+                print(f"{'':<10} {kind:<12} p50 {statistics.median(values) * 1000:8.1f} ms   "
+                      f"p95 {percentile(values, 0.95) * 1000:8.1f} ms")
+
+    api.shutdown()
+    return delivered["scheduler"] == len(updates)
+
+
+# Two applications sharing one SQLite state file, like two workers: search modes set on the
+# first must be seen by the second, and by a third started afterwards (a restart)
+async def check_state(users: int) -> bool:
+    path = _temp_path(".state")
+    first = build_application(StatePersistence(SQLiteStateStore(path)))
+    second = build_application(StatePersistence(SQLiteStateStore(path)))
+    await first.initialize()
+    await second.initialize()
+    user_ids = [200000 + i for i in range(users)]
+    try:
+        for user_id in user_ids:
+            await first.process_update(Update.de_json(callback_update(user_id, "title"), first.bot))
+            await first.process_update(Update.de_json(message_update(user_id, random.choice(TITLE_WORDS)[:4].lower()), first.bot))
+        start = time.perf_counter()
+        await first.update_persistence()
+        await first.persistence.write_pending()
+        flushed = time.perf_counter() - start
+
+        reads = []
+        for user_id in user_ids:
+            user_data = second.user_data[user_id]
+            start = time.perf_counter()
+            await second.persistence.refresh_user_data(user_id, user_data)
+            reads.append(time.perf_counter() - start)
+        shared = sum(1 for user_id in user_ids if second.user_data[user_id] == first.user_data[user_id])
+
+        await first.shutdown()
+        third = build_application(StatePersistence(SQLiteStateStore(path)))
+        await third.initialize()
+        restored = sum(1 for user_id in user_ids if third.user_data.get(user_id) == first.user_data[user_id])
+        await third.shutdown()
+        await second.shutdown()
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    reads.sort()
+    print(f"batch write    {users} users in {flushed * 1000:.1f} ms ({first.persistence.flushes} batch)")
+    print(f"refresh        p50 {statistics.median(reads) * 1e6:.0f} us  p99 {percentile(reads, 0.99) * 1e6:.0f} us")
+    print(f"shared state   {shared}/{users} users seen by the second worker")
+    print(f"after restart  {restored}/{users} users restored")
+    return shared == restored == users
+
+
+# Worker of the --workers benchmark: main.worker_application, the factory of the WORKERS mode,
+# with the data layer on the SQLite fixture and mongomock. The Bot API, state file and snapshot
+# come from the environment bench_workers sets before the workers are spawned
+@contextlib.asynccontextmanager
+async def fixture_worker_application(index: int, workers: int, fixture_path: str):
+    sys.stdout = open(os.devnull, "w")  # handle_message prints every input
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    use_sqlite_fixture(fixture_path)
+    use_mongomock()
+    async with main.worker_application(index, workers) as app:
+        yield app
+
+
+# A title search no cache has seen: a random piece of a title word, sometimes with a typo,
+# so every one runs the trigram index over the whole catalog
+def _uncached_search() -> str:
+    word = random.choice(TITLE_WORDS).lower()
+    start = random.randint(0, max(len(word) - 4, 0))
+    text = word[start:start + random.randint(3, 6)]
+    if len(text) > 3 and random.random() < 0.5:
+        position = random.randrange(len(text))
+        text = text[:position] + random.choice("xqz") + text[position + 1:]
+    return text
+
+
+# Throughput of the WORKERS mode: `users` chats each switch to title search and then send
+# title searches and movie IDs, routed by chat to each number of worker processes running
+# main.worker_application against a local Bot API. The searches miss the result cache, so each
+# update costs real CPU time in its worker; use a large catalog (--films 20000) to see scaling.
+# A search only works after its chat's mode switch, so the saved state also shows per-chat order held
+def bench_workers(worker_counts: list, users: int, requests: int, films: int) -> bool:
+    if not use_mongomock():
+        print("--workers needs mongomock: pip install mongomock")
+        return False
+    fixture_path = _temp_path(".sqlite")
+    build_sqlite_fixture(fixture_path, films, max(films // 5, 10))
+    snapshot_path = fixture_path + ".snapshot"
+    # The workers start warm from a snapshot, like a bot that has run before
+    use_sqlite_fixture(fixture_path)
+    sakila_commands.SNAPSHOT_PATH = snapshot_path
+    sakila_commands.load_catalog()
+
+    api = FakeBotAPI(("127.0.0.1", 0))
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    os.environ.update({
+        "TOKEN": "123456:LOAD-TEST",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{api.server_address[1]}/bot",
+        "SNAPSHOT_PATH": snapshot_path,
+        "STATE_BACKEND": "sqlite",
+        "METRICS_PORT": "0",
+        "SEND_RATE_OVERALL": "0",  # the Bot API stand-in has no flood limits to respect
+    })
+
+    user_ids = [300000 + i for i in range(users)]
+    updates = [(user_id, callback_update(user_id, "title")) for user_id in user_ids]
+    for i in range(requests):
+        user_id = user_ids[i % users]
+        text = _uncached_search() if i % 2 == 0 else str(random.randint(1, films))
+        updates.append((user_id, message_update(user_id, text)))
+
+    passed = True
+    print(f"{'workers':<9}{'updates':>9}{'seconds':>9}{'upd/s':>9}{'ordered':>9}  per worker")
+    for workers in worker_counts:
+        state_path = _temp_path(".state")
+        os.environ["STATE_PATH"] = state_path
+        pool = WorkerPool(workers, fixture_worker_application, workers, fixture_path)
+        pool.start()
+        start = time.monotonic()
+        for chat_id, data in updates:
+            pool.route(chat_id, data)
+        processed = pool.stop()
+        elapsed = pool.drained_at - start
+
+        store = SQLiteStateStore(state_path)
+        ordered = sum(1 for user_id in user_ids
+                      if store.get(user_id) is not None and decode_state(store.get(user_id)).get('searching_title'))
+        store.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(state_path + suffix):
+                os.remove(state_path + suffix)
+
+        passed = passed and sum(processed) == len(updates) and ordered == users
+        print(f"{workers:<9}{sum(processed):>9}{elapsed:>9.2f}{sum(processed) / elapsed:>9.0f}"
+              f"{ordered:>6}/{users:<3} {processed}")
+    api.shutdown()
+    for path in (fixture_path, snapshot_path):
+        if os.path.exists(path):
+            os.remove(path)
+    print(f"({os.cpu_count()} CPU cores, {len(api.replies)} replies sent to the local Bot API)")
+    return passed
+
+
+async def run_scenarios(requests: int, concurrency: int, only: list) -> bool:
+    app = build_application()
+    await app.initialize()
+    print(f"{'handler':<22}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}")
+    for name, (mode, make_update) in scenarios().items():
+        if only and name not in only:
+            continue
+        timings, elapsed = await run_scenario(app, mode, make_update, requests, concurrency)
+        print(f"{name:<22}{len(timings):>9}{statistics.median(timings) * 1000:>9.2f}"
+              f"{percentile(timings, 0.95) * 1000:>9.2f}{percentile(timings, 0.99) * 1000:>9.2f}"
+              f"{len(timings) / elapsed:>9.0f}")
+    await app.shutdown()
+    return True
+
+
+async def check_coalescing_app(callers: int) -> bool:
+    app = build_application()
+    await app.initialize()
+    passed = await check_coalescing(app, callers)
+    await app.shutdown()
+    return passed
+
+
+# Running a check against a fresh SQLite fixture with `films` films
+async def run(films: int, check) -> bool:
+    fixture_path = _temp_path(".sqlite")
+    sakila_commands.SNAPSHOT_PATH = fixture_path + ".snapshot"
+    try:
+        build_sqlite_fixture(fixture_path, films, max(films // 5, 10))
+        use_sqlite_fixture(fixture_path)
+        sakila_commands.load_catalog()
+        return await check()
+    finally:
+        for path in (fixture_path, sakila_commands.SNAPSHOT_PATH):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Latency and throughput of every bot handler")
+    parser.add_argument("--requests", type=int, default=500, help="Updates per handler")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--films", type=int, default=1000, help="Films in the SQLite fixture")
+    parser.add_argument("--handlers", default="", help="Comma-separated subset of handlers")
+    parser.add_argument("--coalescing", action="store_true",
+                        help="Check that identical concurrent callbacks run one query instead")
+    parser.add_argument("--callers", type=int, default=100, help="Concurrent callbacks for --coalescing and --isolation")
+    parser.add_argument("--slow-backend", action="store_true",
+                        help="Check that users waiting on a slow database do not wait for each other")
+    parser.add_argument("--delay", type=float, default=0.2, help="Seconds per SQL statement for --slow-backend")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Check that catalog refreshes apply edits to the fixture and idle polls read no rows")
+    parser.add_argument("--mongo", action="store_true",
+                        help="Check the query counter upserts and indexes against mongomock")
+    parser.add_argument("--isolation", action="store_true",
+                        help="Check that concurrent users each get the results of their own request")
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="Send a reply burst to a fake Bot API enforcing flood limits, with and without the scheduler")
+    parser.add_argument("--chats", type=int, default=20, help="Chats in the --rate-limit burst")
+    parser.add_argument("--per-chat", type=int, default=5, help="Replies per chat in the --rate-limit burst")
+    parser.add_argument("--exports", type=int, default=10, help="Bulk /export documents in the --rate-limit burst")
+    parser.add_argument("--state", action="store_true",
+                        help="Check that conversation state is shared through the SQLite store and survives a restart")
+    parser.add_argument("--users", type=int, default=200, help="Users for --state and --workers")
+    parser.add_argument("--workers", default="",
+                        help="Comma-separated worker counts: throughput of the multi-process mode per count")
+    args = parser.parse_args()
+
+    if args.workers:
+        # Worker processes build their own fixture connections, so this runs outside run()
+        worker_counts = [int(count) for count in args.workers.split(",")]
+        sys.exit(0 if bench_workers(worker_counts, args.users, args.requests, args.films) else 1)
+
+    if args.mongo:
+        sys.exit(0 if check_mongo(args.callers) else 1)
+
+    if args.coalescing:
+        check = functools.partial(check_coalescing_app, args.callers)
+    elif args.slow_backend:
+        check = functools.partial(check_slow_backend, args.delay)
+    elif args.refresh:
+        check = check_refresh
+    elif args.isolation:
+        check = functools.partial(check_isolation, args.callers)
+    elif args.rate_limit:
+        check = functools.partial(check_rate_limits, args.chats, args.per_chat, args.exports)
+    elif args.state:
+        check = functools.partial(check_state, args.users)
+    else:
+        only = [name for name in args.handlers.split(",") if name]
+        check = functools.partial(run_scenarios, args.requests, args.concurrency, only)
+    sys.exit(0 if asyncio.run(run(args.films, check)) else 1)
@@ -1,23 +1,79 @@
 import asyncio
+import contextlib
+import functools
+import tempfile
+import zlib
 import nest_asyncio
 import os
 from dotenv import load_dotenv
 from typing import Final
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import Application, Updater, CallbackQueryHandler, CommandHandler, MessageHandler, filters, ContextTypes
 import logging
-from sakila_commands import category_list, create_category_map, movies_by_category, movies_by_year, actors_by_name, movies_by_title, insert_category, insert_year, movies_by_actor, movie_by_id, queries_by_movies, queries_by_category, queries_by_actors, queries_by_year
+from sakila_export import FORMATS
+from sakila_metrics import start_metrics_server
+from sakila_ratelimit import SendScheduler
+from sakila_state import MemoryStateStore, SQLiteStateStore, StatePersistence
+from sakila_workers import WorkerPool
+from sakila_commands import EXPORT_QUERIES, export_movies, metrics, result_cache, coalescer, run_db, run_db_shared, shutdown_db, ensure_mongo_indexes, retry_until_done, MONGO_RETRY_INTERVAL, query_counters, COUNTER_FLUSH_INTERVAL, reseed_leaderboards, check_leaderboards, load_catalog, load_snapshot, reload_snapshot, refresh_catalog, REFRESH_INTERVAL, refresh_every, CATEGORY_TTL, load_categories, get_categories, get_category_name, movies_by_category_page, count_by_category, movies_by_year_page, count_by_year, actors_by_name_page, movies_by_title_page, insert_category, insert_year, insert_actor, movies_by_actor_page, movie_by_id, queries_by_movies, queries_by_category, queries_by_actors, queries_by_year
 
 load_dotenv("sakila.env")
 TOKEN: Final = os.getenv("TOKEN")
 BOT_USERNAME: Final = '@sakila_movies_bot'
 
+# How updates arrive: "polling" (default) or "webhook"
+BOT_MODE: Final = os.getenv("BOT_MODE", "polling")
+# Webhook mode: public URL Telegram posts to, secret it sends back, and the local server address
+WEBHOOK_URL: Final = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET: Final = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_LISTEN: Final = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT: Final = int(os.getenv("PORT", "8443"))  # Render provides PORT
+WEBHOOK_PATH: Final = os.getenv("WEBHOOK_PATH", "telegram")
+# Bot API base URL, e.g. a local fake server for load tests (default: api.telegram.org)
+TELEGRAM_API_URL: Final = os.getenv("TELEGRAM_API_URL")
+
+# Local Prometheus endpoint serving /metrics (METRICS_PORT=0 turns it off)
+METRICS_LISTEN: Final = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT: Final = int(os.getenv("METRICS_PORT", "9100"))
+# Telegram user IDs allowed to use /stats, comma-separated
+ADMIN_IDS: Final = [int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()]
+
+# Outbound flood limits: messages per second for the whole bot (0 turns the scheduler off),
+# per private chat with a short burst, and per group per minute
+SEND_RATE_OVERALL: Final = float(os.getenv("SEND_RATE_OVERALL", "25"))
+SEND_RATE_CHAT: Final = float(os.getenv("SEND_RATE_CHAT", "1"))
+SEND_BURST_CHAT: Final = float(os.getenv("SEND_BURST_CHAT", "3"))
+SEND_RATE_GROUP: Final = float(os.getenv("SEND_RATE_GROUP", "20"))
+
+# Where conversation state (search modes, recent searches) is kept: "sqlite" (default, survives
+# restarts and can be shared by several workers) or "memory", and how often changes are saved
+STATE_BACKEND: Final = os.getenv("STATE_BACKEND", "sqlite")
+STATE_PATH: Final = os.getenv("STATE_PATH", "sakila_state.db")
+STATE_FLUSH_INTERVAL: Final = float(os.getenv("STATE_FLUSH_INTERVAL", "1"))
+
+# Worker processes handling updates, sharded by chat (WORKERS=1: everything in this process)
+WORKERS: Final = int(os.getenv("WORKERS", "1"))
+
 # Pagination variables
 MOVIES_PER_PAGE = 10
 YEARS_PER_PAGE = 10
+SEARCH_RESULTS_PER_PAGE = 10
+# Recent search texts kept per user for the Previous/Next buttons of their results
+MAX_SEARCHES = 20
+
+# Join result rows into message text, one row per line
+def format_rows(rows: list) -> str:
+    return '\n'.join(str(row) for row in rows)
+
 
-# Generate keyboard for years
+# Generate keyboard for years. Pages come from callback data, so they are clamped to the
+# grid's few pages before the cache, which builds each of them once
 def generate_year_keyboard(page: int):
+    return _year_keyboard(min(max(page, 0), (2025 - 1990) // YEARS_PER_PAGE))
+
+
+@functools.lru_cache(maxsize=8)
+def _year_keyboard(page: int):
     years = [str(year) for year in range(1990 + page * YEARS_PER_PAGE, 1990 + (page + 1) * YEARS_PER_PAGE)]
     keyboard = [
         [InlineKeyboardButton(year, callback_data=f'year_{year}') for year in years[i:i+5]]
@@ -33,27 +89,111 @@ def generate_year_keyboard(page: int):
     return InlineKeyboardMarkup(keyboard)
 
 
+# Keyset cursors carried in callback_data: "<sort value>.<film_id>"
+def encode_cursor(value, film_id) -> str:
+    return f'{value}.{film_id}'
+
+
+def decode_cursor(cursor: str) -> tuple:
+    value, film_id = cursor.rsplit('.', 1)
+    return value, int(film_id)
+
+
+# Number of pages for a total row count
+def count_pages(total: int) -> int:
+    return (total + MOVIES_PER_PAGE - 1) // MOVIES_PER_PAGE
+
+
+# Rendered pages (text and keyboard) are kept in the result cache under the kind of the rows
+# they show, so they expire and are invalidated together with those rows.
+# page is the callback data that requested the page
+def get_rendered_page(kind: str, key: str, page: str):
+    return result_cache.get((kind, 'rendered', key, page))
+
+
+def put_rendered_page(kind: str, key: str, page: str, text: str, reply_markup: InlineKeyboardMarkup):
+    result_cache.put((kind, 'rendered', key, page), (text, reply_markup))
+
+
 # Generate keyboard for movies by years
-def generate_movie_year_keyboard(page: int, total_pages: int, year: str) -> InlineKeyboardMarkup:
+def generate_movie_year_keyboard(page: int, total_pages: int, year: str, movies_page: list) -> InlineKeyboardMarkup:
     keyboard = []
     navigation_buttons = []
-    if page > 0:
-        navigation_buttons.append(InlineKeyboardButton("Previous", callback_data=f'year_{year}_prev_{page}'))
-    if (page == 0) or (page < total_pages - 1):
-        navigation_buttons.append(InlineKeyboardButton("Next", callback_data=f'year_{year}_next_{page}'))
+    if page > 0 and movies_page:
+        first = encode_cursor(movies_page[0].category, movies_page[0].film_id)
+        navigation_buttons.append(InlineKeyboardButton("Previous", callback_data=f'year_{year}_prev_{page}_{first}'))
+    if page < total_pages - 1 and movies_page:
+        last = encode_cursor(movies_page[-1].category, movies_page[-1].film_id)
+        navigation_buttons.append(InlineKeyboardButton("Next", callback_data=f'year_{year}_next_{page}_{last}'))
     if navigation_buttons:
         keyboard.append(navigation_buttons)
     return InlineKeyboardMarkup(keyboard)
 
 
+# Search texts are kept in user_data under a short key, because callback data is limited to 64 bytes
+def remember_search(context: ContextTypes.DEFAULT_TYPE, text: str) -> str:
+    searches = context.user_data.setdefault('searches', {})
+    key = f'{zlib.crc32(text.encode()):08x}'
+    searches.pop(key, None)
+    searches[key] = text
+    while len(searches) > MAX_SEARCHES:
+        searches.pop(next(iter(searches)))
+    return key
+
+
+# Generate keyboard for search results: kind is title, actor or films (movies of an actor)
+def generate_search_keyboard(kind: str, key: str, page: int, total_pages: int) -> InlineKeyboardMarkup:
+    navigation_buttons = []
+    if page > 0:
+        navigation_buttons.append(InlineKeyboardButton("Previous", callback_data=f'find_{kind}_{key}_{page-1}'))
+    if page < total_pages - 1:
+        navigation_buttons.append(InlineKeyboardButton("Next", callback_data=f'find_{kind}_{key}_{page+1}'))
+    return InlineKeyboardMarkup([navigation_buttons] if navigation_buttons else [])
+
+
+# One page of search results as (text, keyboard), or None when there is nothing to show.
+# key is the remembered search for title and actor, the actor ID for films.
+# count: sending the actor to the query database (the initial lookup, not a page turn)
+async def render_search_page(context: ContextTypes.DEFAULT_TYPE, kind: str, key: str, page: int, count: bool = False):
+    offset = page * SEARCH_RESULTS_PER_PAGE
+    if kind == 'films':
+        actor, rows, total = await run_db(movies_by_actor_page, key, offset, SEARCH_RESULTS_PER_PAGE)
+        if actor is None:
+            return None
+        if count:
+            insert_actor(actor.actor_id, actor.first_name, actor.last_name)
+        header = f'Movies with {actor.first_name} {actor.last_name}'
+        footer = 'To get information about a movie, go to the movie search mode by title or by movie ID number. To do this, press /keyword and select the <Movie ID or Movie Title> mode.'
+    else:
+        text = context.user_data.get('searches', {}).get(key)
+        if text is None:
+            return None
+        if kind == 'title':
+            rows, total = await run_db(movies_by_title_page, text, offset, SEARCH_RESULTS_PER_PAGE)
+            header = 'Movies found'
+            footer = 'Enter the movie ID to get more details or enter another movie title:'
+        else:
+            rows, total = await run_db(actors_by_name_page, text, offset, SEARCH_RESULTS_PER_PAGE)
+            header = 'Actors found'
+            footer = 'Enter the actor ID to see the movies they played in or enter another actor name:'
+    if not rows:
+        return None
+
+    total_pages = (total + SEARCH_RESULTS_PER_PAGE - 1) // SEARCH_RESULTS_PER_PAGE
+    new_text = f'{header} ({offset + 1}-{offset + len(rows)} of {total}):\n\n' + format_rows(rows) + f'\n\n{footer}'
+    return new_text, generate_search_keyboard(kind, key, page, total_pages)
+
+
 # Generate keyboard for movies by category
-def generate_pagination_keyboard(page: int, total_pages: int, category_id: str) -> InlineKeyboardMarkup:
+def generate_pagination_keyboard(page: int, total_pages: int, category_id: str, movies_page: list) -> InlineKeyboardMarkup:
     keyboard = []
     navigation_buttons = []
-    if page > 0:
-        navigation_buttons.append(InlineKeyboardButton("Previous", callback_data=f'cat_{category_id}_prev_{page-1}'))
-    if (page == 0) or (page < total_pages - 1):
-        navigation_buttons.append(InlineKeyboardButton("Next", callback_data=f'cat_{category_id}_next_{page+1}'))
+    if page > 0 and movies_page:
+        first = encode_cursor(movies_page[0].release_year, movies_page[0].film_id)
+        navigation_buttons.append(InlineKeyboardButton("Previous", callback_data=f'cat_{category_id}_prev_{page-1}_{first}'))
+    if page < total_pages - 1 and movies_page:
+        last = encode_cursor(movies_page[-1].release_year, movies_page[-1].film_id)
+        navigation_buttons.append(InlineKeyboardButton("Next", callback_data=f'cat_{category_id}_next_{page+1}_{last}'))
     if navigation_buttons:
         keyboard.append(navigation_buttons)
     return InlineKeyboardMarkup(keyboard)
@@ -81,7 +221,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /keyword: Allows the user to choose between searching by movie title or actor name.
 /category: Lists movie categories for selection.
 /release: Allows the user to search for movies by release year.
-/queries - The command displays a list of the most popular queries that were searched''')
+/queries - The command displays a list of the most popular queries that were searched
+/export: Sends all movies of a category, year or actor as a file, e.g. /export category Action csv or /export year 2006 jsonl''')
 
 
 
@@ -118,17 +259,13 @@ async def button_keyword(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # Category command
 async def category_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    category_list()  # Refresh the categories list
-    with open('categories.txt', 'r') as file:
-        categories = file.readlines()
+    categories = get_categories()
 
     keyboard = []
     for i in range(0, len(categories), 2):
         row = []
-        for j in range(2):
-            if i + j < len(categories):
-                category_id, category_name = categories[i + j].strip().split('. ')
-                row.append(InlineKeyboardButton(category_name, callback_data=f'cat_{category_id}_page_0'))
+        for category in categories[i:i + 2]:
+            row.append(InlineKeyboardButton(category.name, callback_data=f'cat_{category.category_id}_page_0'))
         keyboard.append(row)
     
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -142,38 +279,43 @@ async def button_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     data = query.data
 
     print(f"button_category working: {data}")
-    # Load the category map from the file
-    CATEGORY_MAP = create_category_map('categories.txt')
     try:
         # Extract category ID and page number from callback data
         if data.startswith("cat_"):
-            parts = data.split('_')
+            parts = data.split('_', 4)
             print(f"Parsed parts: {parts}")  # Debugging: Print the parsed parts
             direction = 'page'
-            if len(parts) == 4 and parts[1].isdigit() and parts[3].isdigit():
+            if len(parts) in (4, 5) and parts[1].isdigit() and parts[3].isdigit():
                 category_id = parts[1]
                 page = int(parts[3])
                 direction = parts[2]
-                
-                # Fetch movies for the selected category
-                movies_by_category(category_id)
-                
-                with open('movies_by_cat.txt', 'r') as file:
-                    movies = file.readlines()
-                
-                MOVIES_PER_PAGE = 10
-                start = page * MOVIES_PER_PAGE
-                end = start + MOVIES_PER_PAGE
-                movies_page = movies[start:end]
+                category_name = get_category_name(category_id)
 
-                category_name = CATEGORY_MAP.get(category_id, 'Unknown Category')
-                
-                total_pages = (len(movies) + MOVIES_PER_PAGE - 1) // MOVIES_PER_PAGE
-                reply_markup = generate_pagination_keyboard(page, total_pages, category_id)
-                new_text = f'Films by category "{category_name}":\n\n' + ''.join(movies_page) + '\nMovies are sorted by release YEAR'
+                rendered = get_rendered_page('category', category_id, data)
+                if rendered is not None:
+                    new_text, reply_markup = rendered
+                else:
+                    # Seek from the cursor of the page the button was on
+                    after = before = None
+                    if len(parts) == 5:
+                        release_year, film_id = decode_cursor(parts[4])
+                        cursor = (int(release_year), film_id)
+                        if direction == 'next':
+                            after = cursor
+                        elif direction == 'prev':
+                            before = cursor
+
+                    # Fetch one page of movies for the selected category
+                    movies_page = await run_db_shared(movies_by_category_page, category_id, after, before, MOVIES_PER_PAGE)
+                    total = await run_db_shared(count_by_category, category_id)
+
+                    total_pages = count_pages(total)
+                    reply_markup = generate_pagination_keyboard(page, total_pages, category_id, movies_page)
+                    new_text = f'Films by category "{category_name}":\n\n' + format_rows(movies_page) + '\n\nMovies are sorted by release YEAR'
+                    if movies_page:
+                        put_rendered_page('category', category_id, data, new_text, reply_markup)
 
                 if direction == 'page':
-                    new_text = f'Films by category "{category_name}":\n\n' + ''.join(movies_page) + '\nMovies are sorted by release YEAR'
                     insert_category(category_id, category_name)
                     await query.message.reply_text(new_text, reply_markup=reply_markup)
                 else:
@@ -187,8 +329,6 @@ async def button_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError as e:
         print(f"Error: {e}")
         await query.message.reply_text('Invalid callback data format. Please try again.')
-    except FileNotFoundError:
-        await query.message.reply_text('Movies data file not found.')
     except Exception as e:
         print(f"Unexpected error: {e}")
         await query.message.reply_text('An unexpected error occurred. Please try again later.')
@@ -211,30 +351,37 @@ async def button_release(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         if data.startswith('year_'):
-            parts = data.split('_')
+            parts = data.split('_', 4)
             year = parts[1]
             page = 0
             direction = 'next'
-            if len(parts) == 4:
+            after = before = None
+            if len(parts) == 5:
                 direction = parts[2]
                 page = int(parts[3])
+                cursor = decode_cursor(parts[4])
                 if direction == 'next':
                     page += 1
+                    after = cursor
                 elif direction == 'prev':
                     page -= 1
+                    before = cursor
 
-            movies_by_year(year)
-            with open('movies_by_year.txt', 'r') as file:
-                movies = file.readlines()
+            rendered = get_rendered_page('year', year, data)
+            if rendered is not None:
+                new_text, reply_markup = rendered
+            else:
+                movies_page = await run_db_shared(movies_by_year_page, year, after, before, MOVIES_PER_PAGE)
+                total = await run_db_shared(count_by_year, year)
 
-            total_pages = (len(movies) + MOVIES_PER_PAGE - 1) // MOVIES_PER_PAGE
-            movies_page = movies[page * MOVIES_PER_PAGE: (page + 1) * MOVIES_PER_PAGE]
+                total_pages = count_pages(total)
 
-            reply_markup = generate_movie_year_keyboard(page, total_pages, year)
-            new_text = f'Films released in {year}:\n\n' + ''.join(movies_page) + '\nFilms are sorted by CATEGORY'
+                reply_markup = generate_movie_year_keyboard(page, total_pages, year, movies_page)
+                new_text = f'Films released in {year}:\n\n' + format_rows(movies_page) + '\n\nFilms are sorted by CATEGORY'
+                if movies_page:
+                    put_rendered_page('year', year, data, new_text, reply_markup)
 
             if page == 0 and direction == 'next':
-                new_text = f'Films released in {year}:\n\n' + ''.join(movies_page) + '\nFilms are sorted by CATEGORY'
                 insert_year(year)
                 await query.message.reply_text(new_text, reply_markup=reply_markup)
             else:
@@ -252,8 +399,6 @@ async def button_release(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError as e:
         print(f"ValueError: {e}")
         await query.message.reply_text('Invalid callback data format. Please try again.')
-    except FileNotFoundError:
-        await query.message.reply_text('Movies data file not found.')
     except Exception as e:
         print(f"Unexpected error: {e}")
         await query.message.reply_text('An unexpected error occurred. Please try again later.')
@@ -278,50 +423,108 @@ async def button_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     data = query.data
     
-    if data == "query_movies":
-        # Handle queries by movies
-        queries_by_movies()
-        try:
-            with open('queries_by_movies.txt', 'r') as file:
-                queries = file.read()
+    try:
+        if data == "query_movies":
+            # Handle queries by movies
+            queries = queries_by_movies()
             await query.message.reply_text(f"Here are the most popular queries by movies:\n\n{queries}")
-        except FileNotFoundError:
-            await query.message.reply_text("The file 'queries_by_movies.txt' was not found.")
-        except Exception as e:
-            await query.message.reply_text(f"An error occurred: {e}")
-    elif data == "query_actors":
-        # Handle queries by actors
-        queries_by_actors()
-        try:
-            with open('queries_by_actors.txt', 'r') as file:
-                queries = file.read()
+        elif data == "query_actors":
+            # Handle queries by actors
+            queries = queries_by_actors()
             await query.message.reply_text(f"Here are the most popular queries by actors:\n\n{queries}")
-        except FileNotFoundError:
-            await query.message.reply_text("The file 'queries_by_actors.txt' was not found.")
-        except Exception as e:
-            await query.message.reply_text(f"An error occurred: {e}")
-    elif data == "query_category":
-        # Handle queries by category
-        queries_by_category()
-        try:
-            with open('queries_by_category.txt', 'r') as file:
-                queries = file.read()
+        elif data == "query_category":
+            # Handle queries by category
+            queries = queries_by_category()
             await query.message.reply_text(f"Here are the most popular queries by category:\n\n{queries}")
-        except FileNotFoundError:
-            await query.message.reply_text("The file 'queries_by_category.txt' was not found.")
-        except Exception as e:
-            await query.message.reply_text(f"An error occurred: {e}")
-    elif data == "query_year":
-        # Handle queries by year of release
-        queries_by_year()
-        try:
-            with open('queries_by_year.txt', 'r') as file:
-                queries = file.read()
+        elif data == "query_year":
+            # Handle queries by year of release
+            queries = queries_by_year()
             await query.message.reply_text(f"Here are the most popular queries by year:\n\n{queries}")
-        except FileNotFoundError:
-            await query.message.reply_text("The file 'queries_by_year.txt' was not found.")
-        except Exception as e:
-            await query.message.reply_text(f"An error occurred: {e}")
+    except Exception as e:
+        await query.message.reply_text(f"An error occurred: {e}")
+
+
+
+# Previous/Next buttons of search results
+async def button_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    data = query.data
+
+    try:
+        _, kind, key, page = data.split('_')
+        rendered = await render_search_page(context, kind, key, int(page))
+        if rendered:
+            new_text, reply_markup = rendered
+            await query.message.edit_text(new_text, reply_markup=reply_markup)
+        else:
+            await query.message.reply_text('These results are no longer available. Please search again.')
+    except ValueError as e:
+        print(f"Error: {e}")
+        await query.message.reply_text('Invalid callback data format. Please try again.')
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        await query.message.reply_text('An unexpected error occurred. Please try again later.')
+
+
+
+# Export command: /export category|year|actor <category name or ID, year, actor ID> [csv|jsonl]
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    usage = ('Usage: /export category <name or ID>, /export year <year> or /export actor <actor ID>, '
+             'optionally followed by csv (default) or jsonl')
+    args = list(context.args)
+    fmt = 'csv'
+    if args and args[-1].lower() in FORMATS:
+        fmt = args.pop().lower()
+    if len(args) < 2 or args[0].lower() not in EXPORT_QUERIES:
+        await update.message.reply_text(usage)
+        return
+    kind, key = args[0].lower(), ' '.join(args[1:])
+
+    if kind == 'category' and not key.isdigit():
+        # Categories can also be given by name, as shown by /category
+        matches = [category.category_id for category in get_categories() if category.name.lower() == key.lower()]
+        if not matches:
+            await update.message.reply_text(f'Unknown category "{key}". See /category for the list.')
+            return
+        key = str(matches[0])
+    if not key.isdigit():
+        await update.message.reply_text(usage)
+        return
+
+    # The compressed document is spooled to a temporary file, not kept in memory
+    with tempfile.TemporaryFile() as file:
+        count = await run_db(export_movies, kind, key, fmt, file)
+        if count is None:
+            await update.message.reply_text('The export failed. Please try again later.')
+        elif count == 0:
+            await update.message.reply_text('No movies found to export.')
+        else:
+            file.seek(0)
+            await update.message.reply_document(
+                document=file,
+                filename=f'sakila_{kind}_{key}.{fmt}.gz',
+                caption=f'{count} movies',
+                write_timeout=120
+            )
+
+
+
+# Stats command (admins only): handler, SQL and MongoDB latencies, the result cache
+# and a comparison of the /queries leaderboards with MongoDB
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    cache = result_cache.stats()
+    try:
+        differences = await run_db(check_leaderboards)
+        leaderboards = "match MongoDB" if not differences else '\n'.join(["differ from MongoDB:"] + differences[:10])
+    except Exception as e:
+        leaderboards = f"could not be checked: {e}"
+    await update.message.reply_text(
+        metrics.summary()
+        + f"\n\nResult cache: {cache['entries']} entries, hit rate {cache['hit_rate']:.0%}"
+        + f"\nCoalesced calls: {coalescer.calls} ran, {coalescer.collapsed} shared a running call"
+        + f"\nLeaderboards {leaderboards}"
+    )
 
 
 
@@ -339,45 +542,40 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if is_searching_actor or is_expecting_actor_id:
         if user_input.isdigit():
             actor_id = user_input
-            first_name, last_name = movies_by_actor(actor_id)
-            with open('movies_by_actor.txt', 'r') as file:
-                movies = file.readlines()
-            if movies:
+            rendered = await render_search_page(context, 'films', actor_id, 0, count=True)
+            if rendered:
                 context.user_data['expecting_actor_id'] = False
                 context.user_data['expecting_movie_id'] = True  # Set next state
-                await update.message.reply_text(f'Movies with {first_name} {last_name}:\n\n' + ''.join(movies) + '\n\nTo get information about a movie, go to the movie search mode by title or by movie ID number. To do this, press /keyword and select the <Movie ID or Movie Title> mode.')
+                new_text, reply_markup = rendered
+                await update.message.reply_text(new_text, reply_markup=reply_markup)
             else:
                 await update.message.reply_text('No movies found for that actor ID.')
         else:
-            actors_by_name(user_input)
-            with open('actors_by_name.txt', 'r') as file:
-                actors = file.readlines()
-            if actors:
+            rendered = await render_search_page(context, 'actor', remember_search(context, user_input), 0)
+            if rendered:
                 context.user_data['searching_actor'] = True  # Keep the search by actor state
                 context.user_data['expecting_actor_id'] = True  # Keep expecting actor ID state
-                await update.message.reply_text('Actors found:\n\n' + ''.join(actors) + '\n\nEnter the actor ID to see the movies they played in or enter another actor name:')
+                new_text, reply_markup = rendered
+                await update.message.reply_text(new_text, reply_markup=reply_markup)
             else:
                 await update.message.reply_text('No actors found with that name.')
 
     elif is_searching_title or is_expecting_movie_id:
         if user_input.isdigit():
             movie_id = user_input
-            movie_by_id(movie_id)
-            with open('movie_details.txt', 'r') as file:
-                movie_details = file.read()
+            movie_details = await run_db(movie_by_id, movie_id)
             if movie_details:
                 context.user_data['expecting_movie_id'] = False
-                await update.message.reply_text('Movie details:\n\n' + movie_details)
+                await update.message.reply_text(f'Movie details:\n\n{movie_details}')
             else:
                 await update.message.reply_text('No details found for that movie ID.')
         else:
-            movies_by_title(user_input)
-            with open('movies_by_title.txt', 'r') as file:
-                movies = file.readlines()
-            if movies:
+            rendered = await render_search_page(context, 'title', remember_search(context, user_input), 0)
+            if rendered:
                 context.user_data['searching_title'] = True  # Keep the search by title state
                 context.user_data['expecting_movie_id'] = True  # Keep expecting movie ID state
-                await update.message.reply_text('Movies found:\n\n' + ''.join(movies) + '\n\nEnter the movie ID to get more details or enter another movie title:')
+                new_text, reply_markup = rendered
+                await update.message.reply_text(new_text, reply_markup=reply_markup)
             else:
                 await update.message.reply_text('No movies found with that title.')
 
@@ -399,33 +597,207 @@ async def handle_error(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # logger.error(f"Update {update} caused error {context.error}")
 
 
-# The main part
-async def main():
-    app = (Application.builder().token(TOKEN).build())
-    
-    # Handlers
-    app.add_handler(CommandHandler("start", start_command))
-    app.add_handler(CommandHandler("help", help_command))
-    app.add_handler(CommandHandler("keyword", keyword_command))
-    app.add_handler(CommandHandler("category", category_command))
-    app.add_handler(CommandHandler("release", release_command))
-    app.add_handler(CommandHandler("queries", query_command))
+# Handlers
+def add_handlers(app: Application):
+    # Every handler call is timed into the "handler" histograms
+    def timed(handler):
+        return metrics.timed("handler", handler)
+
+    app.add_handler(CommandHandler("start", timed(start_command)))
+    app.add_handler(CommandHandler("help", timed(help_command)))
+    app.add_handler(CommandHandler("keyword", timed(keyword_command)))
+    app.add_handler(CommandHandler("category", timed(category_command)))
+    app.add_handler(CommandHandler("release", timed(release_command)))
+    app.add_handler(CommandHandler("queries", timed(query_command)))
+    app.add_handler(CommandHandler("export", timed(export_command)))
+    app.add_handler(CommandHandler("stats", timed(stats_command), filters=filters.User(user_id=ADMIN_IDS)))
     
-    app.add_handler(CallbackQueryHandler(button_keyword, pattern="^(title|actor)$"))
-    app.add_handler(CallbackQueryHandler(button_category, pattern=r"^cat_\d+"))
-    app.add_handler(CallbackQueryHandler(button_release, pattern=r'^(year_|next_|prev_)'))
-    app.add_handler(CallbackQueryHandler(button_query, pattern=r"^query_(movies|actors|category|year)$"))
+    app.add_handler(CallbackQueryHandler(timed(button_keyword), pattern="^(title|actor)$"))
+    app.add_handler(CallbackQueryHandler(timed(button_category), pattern=r"^cat_\d+"))
+    app.add_handler(CallbackQueryHandler(timed(button_release), pattern=r'^(year_|next_|prev_)'))
+    app.add_handler(CallbackQueryHandler(timed(button_query), pattern=r"^query_(movies|actors|category|year)$"))
+    app.add_handler(CallbackQueryHandler(timed(button_search), pattern=r"^find_(title|actor|films)_"))
     
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, timed(handle_message)))
 
     # Log all errors
     app.add_error_handler(handle_error)
-    
+
+
+# Outbound send scheduler with the SEND_* limits; its counters are exported on /metrics.
+# Chats are sharded, so only the overall limit is split between workers
+def build_send_scheduler(workers: int = 1) -> SendScheduler:
+    scheduler = SendScheduler(
+        overall_rate=SEND_RATE_OVERALL / workers,
+        overall_burst=SEND_RATE_OVERALL / workers,
+        chat_rate=SEND_RATE_CHAT,
+        chat_burst=SEND_BURST_CHAT,
+        group_rate=SEND_RATE_GROUP / 60
+    )
+    metrics.counter("telegram_sent", "Bot API requests sent through the send scheduler", lambda: scheduler.sent)
+    metrics.counter("telegram_retries", "Bot API requests retried after a 429 retry_after", lambda: scheduler.retries)
+    return scheduler
+
+
+# Conversation state persistence for the STATE_BACKEND; its counters are exported on /metrics
+def build_persistence() -> StatePersistence:
+    if STATE_BACKEND == "memory":
+        store = MemoryStateStore()
+    elif STATE_BACKEND == "sqlite":
+        store = SQLiteStateStore(STATE_PATH)
+    else:
+        raise SystemExit(f"Unknown STATE_BACKEND: {STATE_BACKEND}")
+    persistence = StatePersistence(store, update_interval=STATE_FLUSH_INTERVAL)
+    metrics.counter("state_flushes", "Batches of conversation state written to the store", lambda: persistence.flushes)
+    metrics.counter("state_refreshes", "Conversation states reloaded after another worker changed them", lambda: persistence.refreshes)
+    return persistence
+
+
+# Application with the handlers, send scheduler and state persistence.
+# workers > 1: this process is one of several sharing the overall send rate
+def build_application(workers: int = 1) -> Application:
+    builder = Application.builder().token(TOKEN)
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(TELEGRAM_API_URL)
+    if SEND_RATE_OVERALL:
+        builder = builder.rate_limiter(build_send_scheduler(workers))
+    builder = builder.persistence(build_persistence())
+    app = builder.build()
+    add_handlers(app)
+    return app
+
+
+# Load the catalog, counters and background refreshes the handlers rely on; returns what
+# stop_services needs to shut them down. In the WORKERS mode (workers > 1) only worker 0 reads
+# the catalog from MySQL and keeps the snapshot file current; the others serve from that file
+async def start_services(metrics_port: int, index: int = 0, workers: int = 1) -> tuple:
+    # Load the in-memory catalog and indexes before serving. With a local snapshot the bot
+    # serves from it right away while the catalog is reloaded from MySQL in the background
+    catalog_refresh = None
+    catalog = await run_db(load_snapshot)
+    if index > 0:
+        if catalog is None:
+            logging.info(f"Worker {index}: querying MySQL until worker 0 has written the snapshot")
+    elif catalog is not None:
+        logging.info("Serving from the local snapshot while the catalog refreshes")
+        catalog_refresh = asyncio.create_task(run_db(load_catalog))
+    else:
+        catalog = await run_db(load_catalog)
+    if catalog is not None:
+        logging.info(f"Film catalog: {len(catalog)} films in {catalog.memory_bytes() / 1024:.0f} KiB")
+
+    query_counters.start()
+    # The /queries leaderboards start empty and are seeded from MongoDB beside serving updates,
+    # so a MongoDB outage does not hold up startup
+    tasks = [asyncio.create_task(retry_until_done(MONGO_RETRY_INTERVAL, reseed_leaderboards))]
+    if index == 0:
+        tasks += [
+            # Index creation waits on MongoDB round trips, so it runs beside serving updates
+            asyncio.create_task(retry_until_done(MONGO_RETRY_INTERVAL, ensure_mongo_indexes)),
+            asyncio.create_task(refresh_every(CATEGORY_TTL, load_categories)),
+            asyncio.create_task(refresh_every(REFRESH_INTERVAL, refresh_catalog)),
+        ]
+    else:
+        tasks.append(asyncio.create_task(refresh_every(REFRESH_INTERVAL, reload_snapshot)))
+    if workers > 1:
+        # Each worker sees only its own chats' clicks; the other workers' arrive through MongoDB
+        tasks.append(asyncio.create_task(refresh_every(COUNTER_FLUSH_INTERVAL, reseed_leaderboards)))
+    if catalog_refresh is not None:
+        tasks.append(catalog_refresh)
+
+    metrics_server = None
+    if metrics_port:
+        metrics_server = start_metrics_server(metrics, METRICS_LISTEN, metrics_port)
+        logging.info(f"Metrics on http://{METRICS_LISTEN}:{metrics_port}/metrics")
+    return tasks, metrics_server
+
+
+async def stop_services(services: tuple):
+    tasks, metrics_server = services
+    for task in tasks:
+        task.cancel()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    shutdown_db()
+
+
+# Worker process of the WORKERS mode: the handlers run here, updates come from the front process.
+# Every worker serves its own metrics on METRICS_PORT + 1 + index
+@contextlib.asynccontextmanager
+async def worker_application(index: int, workers: int):
+    services = await start_services(METRICS_PORT + 1 + index if METRICS_PORT else 0, index, workers)
+    app = build_application(workers)
+    await app.initialize()
+    await app.start()
+    try:
+        yield app
+    finally:
+        await app.stop()
+        await app.shutdown()
+        await stop_services(services)
+
+
+# Start receiving updates by polling or webhook into the updater's queue
+async def start_updater(updater):
+    if BOT_MODE == "webhook":
+        # Telegram POSTs updates to the embedded server, which checks the secret token header
+        # and puts them straight on the update queue
+        await updater.start_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            webhook_url=WEBHOOK_URL
+        )
+    else:
+        await updater.start_polling()
+
+
+# Front process of the WORKERS mode: receives updates and routes each one to a worker by chat_id
+async def run_workers():
+    pool = WorkerPool(WORKERS, worker_application, WORKERS)
+    logging.info(f"Starting {WORKERS} workers...")
+    await asyncio.to_thread(pool.start)
+
+    bot = Bot(TOKEN, base_url=TELEGRAM_API_URL) if TELEGRAM_API_URL else Bot(TOKEN)
+    updater = Updater(bot, asyncio.Queue())
+    await updater.initialize()
+    await start_updater(updater)
+    forward = asyncio.create_task(pool.forward(updater.update_queue))
+    logging.info("Bot is running...")
+
+    # Waiting for the stop (Ctrl+C)
+    try:
+        await asyncio.Event().wait()
+    except (KeyboardInterrupt, SystemExit):
+        logging.info("Stopping the bot...")
+
+    await updater.stop()
+    await updater.shutdown()
+    forward.cancel()
+    processed = await asyncio.to_thread(pool.stop)
+    logging.info(f"Updates handled per worker: {processed}")
+
+
+# The main part
+async def main():
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        raise SystemExit("WEBHOOK_SECRET must be set in webhook mode")
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        raise SystemExit("WEBHOOK_URL must be set in webhook mode (the public HTTPS URL Telegram posts to)")
+    if WORKERS > 1:
+        await run_workers()
+        logging.info("Bot has been stopped.")
+        return
+
+    app = build_application()
+    services = await start_services(METRICS_PORT)
+
     # Launching the bot
     logging.info("Bot is running...")
     await app.initialize()
     await app.start()
-    await app.updater.start_polling()
+    await start_updater(app.updater)
 
     # Waiting for the stop (Ctrl+C)
     try:
@@ -437,6 +809,7 @@ async def main():
     await app.updater.stop()
     await app.stop()
     await app.shutdown()
+    await stop_services(services)
     logging.info("Bot has been stopped.")
 
 # Launch
@@ -1,164 +1,428 @@
 # Module of functions for working with SQL
 
+import asyncio
+import functools
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import NamedTuple, Optional
 from dotenv import load_dotenv
 import mysql.connector
-from pymongo import MongoClient
+from mysql.connector import pooling
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import ConnectionFailure, PyMongoError
+from sakila_cache import ResultCache, SingleFlight
+from sakila_export import stream_rows, write_export
+from sakila_counters import CounterBuffer, Leaderboard
+from sakila_index import ActorIndex, FilmCatalog, TrigramIndex, normalize
+from sakila_metrics import Metrics
+from sakila_slowlog import SlowQueryLog
+from sakila_snapshot import read_snapshot, write_snapshot
 
 load_dotenv("sakila.env")
 
-# Connection to read
-def connect_db():
-    dbconfig = {
+# Size of the MySQL connection pool (mysql.connector allows at most 32)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+
+# Threads for blocking database calls; never more than the pool can serve at once,
+# because an exhausted mysql.connector pool raises instead of waiting
+DB_WORKERS = min(int(os.getenv("DB_WORKERS", str(DB_POOL_SIZE))), DB_POOL_SIZE)
+
+# Pooled connections unused for longer than this many seconds are pinged before use
+POOL_PING_IDLE = float(os.getenv("POOL_PING_IDLE", "30"))
+
+# How long cached COUNT(*) results for pagination stay valid, in seconds
+COUNT_TTL = int(os.getenv("COUNT_TTL", "300"))
+
+# Result cache limits and per-kind lifetimes, in seconds
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_TTLS = {
+    'category': int(os.getenv("CACHE_TTL_CATEGORY", "600")),
+    'year': int(os.getenv("CACHE_TTL_YEAR", "600")),
+    'actor': int(os.getenv("CACHE_TTL_ACTOR", "600")),
+    'title': int(os.getenv("CACHE_TTL_TITLE", "300")),
+    'movie': int(os.getenv("CACHE_TTL_MOVIE", "3600")),
+    'count': COUNT_TTL,
+}
+
+# How long a MongoDB operation waits for a reachable server, in milliseconds, and how often
+# startup work that needs MongoDB is retried while it is down, in seconds
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", "5000"))
+MONGO_RETRY_INTERVAL = float(os.getenv("MONGO_RETRY_INTERVAL", "30"))
+
+# Write-behind flush triggers for the query counters
+COUNTER_FLUSH_SIZE = int(os.getenv("COUNTER_FLUSH_SIZE", "500"))
+COUNTER_FLUSH_INTERVAL = float(os.getenv("COUNTER_FLUSH_INTERVAL", "5"))
+
+# Local copy of the catalog used for a warm start
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "sakila_snapshot.bin")
+
+# How often rows changed in MySQL are polled and applied to the catalog, in seconds
+REFRESH_INTERVAL = int(os.getenv("REFRESH_INTERVAL", "10"))
+# How long rows of the newest second already applied are read again, in case a transaction
+# that started in that second commits late, in seconds
+DELTA_LOOKBACK = int(os.getenv("DELTA_LOOKBACK", "60"))
+
+# How often the in-memory category catalog is reloaded, in seconds
+CATEGORY_TTL = int(os.getenv("CATEGORY_TTL", "3600"))
+
+# Rows fetched per round trip when streaming an export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Slow-query log: statements taking at least SLOW_QUERY_MS (negative turns it off),
+# with an EXPLAIN plan once per statement shape
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "1") == "1"
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "slow_queries.log")
+
+_pool = None
+_pool_lock = threading.Lock()
+_mongo_client = None
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="sakila_db")
+
+
+def _db_config() -> dict:
+    return {
         'host': os.getenv("DB_HOST"),
         'user': os.getenv("DB_USER"),
         'password': os.getenv("DB_PASSWORD"),
         'database': os.getenv("DB_SAKILA")
     }
 
-    return mysql.connector.connect(**dbconfig)
 
-# Connecting to MongoDB Atlas to write and read the queries
-def connect_mongo():
-    mongo_uri = os.getenv("MONGO_URI")
-    mongo_db = os.getenv("MONGO_DB")
+# Connection to read (one new connection per call, kept for scripts and benchmarks)
+def connect_db():
+    return mysql.connector.connect(**_db_config())
 
-    client = MongoClient(mongo_uri)
-    return client[mongo_db]
 
+# Creating the connection pool once per process
+def get_pool() -> pooling.MySQLConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name="sakila_pool",
+                    pool_size=DB_POOL_SIZE,
+                    pool_reset_session=True,
+                    **_db_config()
+                )
+    return _pool
 
 
-# Getting list of movie categories
-def category_list():
-    connection = connect_db()
-    cursor = connection.cursor()
-    cursor.execute("SELECT category_id, name FROM sakila.category;")
-    
-    result = cursor.fetchall()
-    
-    cursor.close()
-    connection.close()
-    
-    # Join the results into a single string with each row on a new line
-    result_str = '\n'.join(f"{row[0]:2}. {row[1]}" for row in result)
-    # Write the result string to a text file
-    with open('categories.txt', 'w') as file:
-        file.write(result_str)
+# When each pooled connection (by server connection ID) last went back to the pool
+_last_used = {}
 
 
-# Creating category dictionary from category list
-def create_category_map(file_path: str) -> dict:
-    category_map = {}
+# Borrowing a connection from the pool and giving it back after use
+@contextmanager
+def get_connection():
+    connection = get_pool().get_connection()
     try:
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-            for line in lines:
-                if line.strip():
-                    # Extract category number and name
-                    parts = line.split('.')
-                    if len(parts) == 2:
-                        category_id = parts[0].strip()
-                        category_name = parts[1].strip()
-                        category_map[category_id] = category_name
-    except FileNotFoundError:
-        print(f"File not found: {file_path}")
-    return category_map
+        # Health check only after POOL_PING_IDLE seconds unused: reconnect if the server closed
+        # the idle connection. Recently used connections skip the extra round trip
+        if time.monotonic() - _last_used.pop(connection.connection_id, 0) > POOL_PING_IDLE:
+            connection.ping(reconnect=True, attempts=1, delay=0)
+        yield connection
+    finally:
+        _last_used[connection.connection_id] = time.monotonic()
+        # close() on a pooled connection returns it to the pool
+        connection.close()
 
 
-# Sending the selected movie category to the query database
-def insert_category(category_id: str, category_name: str):
-    db = connect_mongo()
-    collection = db["category"]
+# Running a blocking database function on the worker threads, off the event loop
+async def run_db(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
 
-    existing = collection.find_one({"category_id": category_id})
 
-    if existing:
-        collection.update_one(
-            {"category_id": category_id},
-            {"$inc": {"count": 1}}
-        )
-    else:
-        collection.insert_one({
-            "category_id": category_id,
-            "category_name": category_name,
-            "count": 1
-        })
+# Identical database calls made while one is running share its result
+coalescer = SingleFlight()
 
 
+# Running a read-only database function through the coalescer: concurrent calls with the
+# same function and arguments become one call. Not for functions that count queries
+async def run_db_shared(func, *args):
+    return await coalescer.do((func.__name__,) + args, lambda: run_db(func, *args))
 
 
+# Waiting for running database calls to finish on shutdown
+def shutdown_db():
+    _executor.shutdown(wait=True)
+    query_counters.stop()
+    if _mongo_client is not None:
+        _mongo_client.close()
 
 
-# Sending the selected year of release of the film to the query base
-def insert_year(year: int):
+# Timings of SQL statements and MongoDB operations; main.py adds the handler timings
+metrics = Metrics()
+metrics.describe("handler", "handler", "Time spent in a bot handler")
+metrics.describe("sql", "statement", "Time to execute a SQL statement and fetch its rows, by result kind")
+metrics.describe("mongo", "operation", "Time of a MongoDB operation, by collection and operation")
+metrics.counter("db_calls", "Coalesced database calls that ran", lambda: coalescer.calls)
+metrics.counter("db_calls_collapsed", "Database calls served by an identical call already running",
+                lambda: coalescer.collapsed)
+
+
+# Connecting to MongoDB Atlas to write and read the queries.
+# One MongoClient per process: it is thread-safe and keeps its own connection pool
+def connect_mongo():
+    global _mongo_client
+    if _mongo_client is None:
+        with _pool_lock:
+            if _mongo_client is None:
+                _mongo_client = MongoClient(os.getenv("MONGO_URI"), serverSelectionTimeoutMS=MONGO_TIMEOUT_MS)
+    return _mongo_client[os.getenv("MONGO_DB")]
+
+
+# Key field of each query-counter collection
+MONGO_KEYS = {
+    "category": "category_id",
+    "year": "release_year",
+    "movie": "film_id",
+    "actor": "actor_id",
+}
+
+
+# Unique key indexes for the upserts and count indexes for the top-10 sorts
+# Returns False when MongoDB is unreachable, after one server selection timeout
+def ensure_mongo_indexes() -> bool:
     db = connect_mongo()
-    collection = db["year"]
+    for collection_name, key in MONGO_KEYS.items():
+        try:
+            with metrics.timer("mongo", f"{collection_name}.create_index"):
+                db[collection_name].create_index(key, unique=True)
+                db[collection_name].create_index([("count", -1)])
+        except ConnectionFailure as e:
+            print(f"MongoDB unreachable, indexes not created yet: {e}")
+            return False
+        except Exception as e:
+            # Duplicates left by the old find/insert code block the unique index
+            print(f"Could not create indexes on {collection_name}: {e}")
+    return True
+
+
+# Writing a batch of coalesced counter increments, one bulk_write per collection
+def _write_counters(batch: dict):
+    db = connect_mongo()
+    for collection_name, increments in batch.items():
+        key = MONGO_KEYS[collection_name]
+        with metrics.timer("mongo", f"{collection_name}.bulk_write"):
+            db[collection_name].bulk_write([
+                UpdateOne({key: key_value}, {"$inc": {"count": count}, "$setOnInsert": fields}, upsert=True)
+                for key_value, count, fields in increments
+            ], ordered=False)
 
-    existing = collection.find_one({"release_year": year})
 
-    if existing:
-        collection.update_one(
-            {"release_year": year},
-            {"$inc": {"count": 1}}
-        )
-    else:
-        collection.insert_one({
-            "release_year": year,
-            "count": 1
-        })
+query_counters = CounterBuffer(_write_counters, COUNTER_FLUSH_SIZE, COUNTER_FLUSH_INTERVAL)
 
+# Top-10 per collection served to /queries without touching MongoDB
+leaderboards = {collection_name: Leaderboard(10) for collection_name in MONGO_KEYS}
 
 
-def insert_movie(film_id, title, release_year, description, category_id, category_name, length, rating):
-    db = connect_mongo()
-    collection = db.movie
+# Counting a query in the leaderboard now; it reaches MongoDB on the next flush
+def _increment(collection_name: str, key_value, fields: dict):
+    leaderboards[collection_name].increment(key_value, fields)
+    query_counters.add(collection_name, key_value, fields)
 
-    existing = collection.find_one({"film_id": film_id})
-    if existing:
-        collection.update_one({"_id": existing["_id"]}, {"$inc": {"count": 1}})
-    else:
-        collection.insert_one({
-            "film_id": film_id,
-            "title": title,
-            "release_year": release_year,
-            "description": description,
-            "category_id": category_id,
-            "category_name": category_name,
-            "length": length,
-            "rating": rating,
-            "count": 1
-        })
 
 
+# Result rows returned to the bot handlers
 
+class CategoryRow(NamedTuple):
+    category_id: int
+    name: str
 
-def insert_actor(actor_id: str, first_name: str, last_name: str):
-    db = connect_mongo()
-    collection = db["actor"]
+    def __str__(self):
+        return f"{self.category_id:2}. {self.name}"
+
+
+class FilmRow(NamedTuple):
+    film_id: int
+    title: str
+    release_year: int
+
+    def __str__(self):
+        return f"[{self.film_id:4}] {self.title}, {self.release_year}"
+
+
+class FilmCategoryRow(NamedTuple):
+    film_id: int
+    title: str
+    category: str
+
+    def __str__(self):
+        return f"[{self.film_id:4}] {self.title}, {self.category}"
+
+
+class ActorRow(NamedTuple):
+    actor_id: int
+    first_name: str
+    last_name: str
+
+    def __str__(self):
+        return f"[{self.actor_id:3}] {self.first_name} {self.last_name}"
+
+
+class FilmDetails(NamedTuple):
+    film_id: int
+    title: str
+    release_year: int
+    description: str
+    category_id: int
+    category_name: str
+    length: int
+    rating: str
+
+    def __str__(self):
+        return f"""Film ID: [{self.film_id}]
+Title: {self.title}
+Release year: {self.release_year}
+Description: {self.description}
+Category: {self.category_name}
+Length: {self.length}
+Rating: {self.rating}"""
+
+
+result_cache = ResultCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_TTLS)
+slow_queries = SlowQueryLog(SLOW_QUERY_LOG, SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN)
+
+
+# Cache key from the kind, the statement and case-insensitive parameters
+def _cache_key(kind: str, query: str, params: tuple) -> tuple:
+    return (kind, query) + tuple(str(param).lower() for param in params)
+
+
+# Running a read query on a pooled connection; results are cached when a kind is given
+def fetch_all(query: str, params: tuple = (), kind: str = None) -> list:
+    if kind is not None:
+        key = _cache_key(kind, query, params)
+        rows = result_cache.get(key)
+        if rows is not None:
+            return rows
+
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        try:
+            start = time.perf_counter()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            elapsed = time.perf_counter() - start
+        finally:
+            cursor.close()
+        metrics.observe("sql", kind or "catalog", elapsed)
+        if elapsed >= slow_queries.threshold:
+            slow_queries.record(connection, query, params, len(rows), elapsed)
+
+    if kind is not None:
+        result_cache.put(key, rows)
+    return rows
+
+
+def fetch_one(query: str, params: tuple = (), kind: str = None):
+    rows = fetch_all(query, params, kind)
+    return rows[0] if rows else None
 
-    existing = collection.find_one({"actor_id": actor_id})
 
-    if existing:
-        collection.update_one(
-            {"actor_id": actor_id},
-            {"$inc": {"count": 1}}
-        )
-    else:
-        collection.insert_one({
-            "actor_id": actor_id,
-            "first_name": first_name,
-            "last_name": last_name,
-            "count": 1
-        })
+
+# Getting list of movie categories
+def category_list() -> list:
+    rows = fetch_all("SELECT category_id, name FROM sakila.category;")
+    return [CategoryRow(*row) for row in rows]
+
+
+# Creating category dictionary from category list
+def create_category_map(categories: list) -> dict:
+    return {str(category.category_id): category.name for category in categories}
+
+
+# In-memory category catalog, loaded at startup and refreshed in the background
+_categories = []
+_category_map = {}
+
+
+def load_categories() -> list:
+    try:
+        categories = category_list()
+    except mysql.connector.Error as err:
+        print(f"Error: {err}")
+        return _categories
+    renamed = _categories and categories != _categories
+    _set_categories(categories)
+    if renamed:
+        # Rendered category pages carry the category name
+        result_cache.invalidate('category')
+    return categories
 
 
+def _set_categories(categories: list):
+    global _categories, _category_map
+    # Swap both references at once so readers never see a half-built catalog
+    _categories, _category_map = categories, create_category_map(categories)
 
 
+def get_categories() -> list:
+    return _categories
 
 
-# Getting list of movies by category
-def movies_by_category(category_id: str):
-    # Ensure category_id is used directly in the SQL query
+def get_category_name(category_id: str) -> str:
+    return _category_map.get(str(category_id), 'Unknown Category')
+
+
+# Running a startup task off the startup path: now, then every `seconds` until it returns True
+async def retry_until_done(seconds: float, func):
+    while True:
+        try:
+            if await run_db(func):
+                return
+        except Exception as e:
+            print(f"{func.__name__} failed, retrying in {seconds:.0f} s: {e}")
+        await asyncio.sleep(seconds)
+
+
+# Calling a blocking loader every `seconds` until the task is cancelled
+async def refresh_every(seconds: int, func):
+    while True:
+        await asyncio.sleep(seconds)
+        try:
+            await run_db(func)
+        except Exception as e:
+            print(f"Refresh of {func.__name__} failed: {e}")
+
+
+# Sending the selected movie category to the query database
+def insert_category(category_id: str, category_name: str):
+    _increment("category", category_id, {"category_name": category_name})
+
+
+# Sending the selected year of release of the film to the query base
+def insert_year(year: int):
+    _increment("year", year, {})
+
+
+def insert_movie(film_id, title, release_year, description, category_id, category_name, length, rating):
+    _increment("movie", film_id, {
+        "title": title,
+        "release_year": release_year,
+        "description": description,
+        "category_id": category_id,
+        "category_name": category_name,
+        "length": length,
+        "rating": rating
+    })
+
+
+def insert_actor(actor_id: str, first_name: str, last_name: str):
+    _increment("actor", actor_id, {"first_name": first_name, "last_name": last_name})
+
+
+
+# Getting one page of movies by category, seeking on (release_year, film_id).
+# after: key of the last row shown (next page), before: key of the first row shown (previous page)
+def movies_by_category_page(category_id: str, after: tuple = None, before: tuple = None, limit: int = 10) -> list:
     query = """
         SELECT 
             film.film_id, title, release_year
@@ -168,30 +432,38 @@ def movies_by_category(category_id: str):
             film_category ON film.film_id = film_category.film_id
         WHERE
             category_id = %s
-        ORDER BY release_year
     """
+    params = [category_id]
+    if after is not None:
+        query += " AND (release_year > %s OR (release_year = %s AND film.film_id > %s))"
+        params += [after[0], after[0], after[1]]
+        query += " ORDER BY release_year, film.film_id LIMIT %s"
+    elif before is not None:
+        query += " AND (release_year < %s OR (release_year = %s AND film.film_id < %s))"
+        params += [before[0], before[0], before[1]]
+        query += " ORDER BY release_year DESC, film.film_id DESC LIMIT %s"
+    else:
+        query += " ORDER BY release_year, film.film_id LIMIT %s"
+    params.append(limit)
 
     try:
-        connection = connect_db()
-        cursor = connection.cursor()
-        cursor.execute(query, (category_id,))
-        movies = cursor.fetchall()
-        # Join the results into a single string with each row on a new line
-        result_str = '\n'.join(f"[{row[0]:4}] {row[1]}, {row[2]}" for row in movies)
-        result_str += '\n'
-        # Save the result to a file or process it as needed
-        with open('movies_by_cat.txt', 'w') as file:
-            file.write(result_str)
+        rows = fetch_all(query, tuple(params), kind='category')
     except mysql.connector.Error as err:
         print(f"Error: {err}")
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+        return []
+    if before is not None:
+        rows = rows[::-1]
+    return [FilmRow(*row) for row in rows]
+
+
+# Counting movies in a category (cached for COUNT_TTL seconds)
+def count_by_category(category_id: str) -> int:
+    query = "SELECT COUNT(*) FROM film_category WHERE category_id = %s;"
+    return _count(query, (category_id,))
 
 
-# Getting list of movies by year of release
-def movies_by_year(year):
+# Getting one page of movies by year of release, seeking on (category.name, film_id)
+def movies_by_year_page(year, after: tuple = None, before: tuple = None, limit: int = 10) -> list:
     query = """
         SELECT 
             film.film_id, title, category.name
@@ -203,84 +475,128 @@ def movies_by_year(year):
             category ON film_category.category_id = category.category_id
         WHERE
             release_year = %s
-        ORDER BY category.name;
-    """                    
-    connection = connect_db()
-    cursor = connection.cursor()
-    cursor.execute(query, (str(year), ))
-                    
-    movies = cursor.fetchall()
-    
-    cursor.close()
-    connection.close()
-        
-    # Join the results into a single string with each row on a new line
-    result_str = '\n'.join(f"[{row[0]:4}] {row[1]}, {row[2]}" for row in movies)
-    result_str += '\n'
-    # Write the result string to a text file
-    with open('movies_by_year.txt', 'w') as file:
-        # file.write(f'Films by release year:\n' + result_str)
-        file.write(result_str)
-
-
-# Getting list of actors by name
-def actors_by_name(actor_name: str):
-    query = f"""
+    """
+    params = [str(year)]
+    if after is not None:
+        query += " AND (category.name > %s OR (category.name = %s AND film.film_id > %s))"
+        params += [after[0], after[0], after[1]]
+        query += " ORDER BY category.name, film.film_id LIMIT %s"
+    elif before is not None:
+        query += " AND (category.name < %s OR (category.name = %s AND film.film_id < %s))"
+        params += [before[0], before[0], before[1]]
+        query += " ORDER BY category.name DESC, film.film_id DESC LIMIT %s"
+    else:
+        query += " ORDER BY category.name, film.film_id LIMIT %s"
+    params.append(limit)
+
+    try:
+        rows = fetch_all(query, tuple(params), kind='year')
+    except mysql.connector.Error as err:
+        print(f"Error: {err}")
+        return []
+    if before is not None:
+        rows = rows[::-1]
+    return [FilmCategoryRow(*row) for row in rows]
+
+
+# Counting movies released in a year (cached for COUNT_TTL seconds)
+def count_by_year(year) -> int:
+    query = """
         SELECT 
-            actor_id, first_name, last_name
+            COUNT(*)
         FROM
-            actor
+            film
+                JOIN
+            film_category ON film.film_id = film_category.film_id
         WHERE
-            first_name LIKE '%{actor_name}%' or last_name LIKE '%{actor_name}%';
+            release_year = %s;
     """
+    return _count(query, (str(year),))
+
+
+def _count(query: str, params: tuple) -> int:
     try:
-        connection = connect_db()
-        cursor = connection.cursor()
-        cursor.execute(query)
-        actors = cursor.fetchall()
-        # Join the results into a single string with each row on a new line
-        result_str = '\n'.join(f"[{row[0]:3}] {row[1]} {row[2]}" for row in actors)
-        # Save the result to a file or process it as needed
-        with open('actors_by_name.txt', 'w') as file:
-            file.write(result_str)
+        row = fetch_one(query, params, kind='count')
     except mysql.connector.Error as err:
         print(f"Error: {err}")
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+        return 0
+    return row[0] if row else 0
+
 
+# Actor name index over the whole actor table, built at startup
+actor_index = None
+# Film IDs of each actor (from film_actor), built at startup
+actor_films = None
 
-# Getting list of movies by title
-def movies_by_title(movie_title: str):
-    query = f"""
+
+# Title search index over the whole film catalog, built at startup
+title_index = None
+
+
+# Ranked index matches for a search, kept in the result cache under the kind of the rows,
+# so turning pages slices the same list instead of searching again
+def _search_matches(kind: str, text: str, search) -> list:
+    key = (kind, 'search', normalize(text))
+    matches = result_cache.get(key)
+    if matches is None:
+        matches = search(text)
+        result_cache.put(key, matches)
+    return matches
+
+
+# One page of movies by title and the total number of matches.
+# MySQL fallback: LIMIT/OFFSET fetches only the rows shown, the total is a cached COUNT(*)
+def movies_by_title_page(movie_title: str, offset: int = 0, limit: int = 10) -> tuple:
+    if title_index is not None:
+        matches = _search_matches('title', movie_title, title_index.search)
+        return matches[offset:offset + limit], len(matches)
+
+    query = """
         SELECT 
             film_id, title, release_year
         FROM
             film
         WHERE
-            title LIKE '%{movie_title}%';
+            title LIKE %s
+        ORDER BY title, film_id
+        LIMIT %s OFFSET %s;
     """
+    pattern = f"%{movie_title}%"
     try:
-        connection = connect_db()
-        cursor = connection.cursor()
-        cursor.execute(query)
-        movies = cursor.fetchall()
-        # Join the results into a single string with each row on a new line
-        result_str = '\n'.join(f"[{row[0]:4}] {row[1]}, {row[2]}" for row in movies)
-        # Save the result to a file or process it as needed
-        with open('movies_by_title.txt', 'w') as file:
-            file.write(result_str)
+        rows = [FilmRow(*row) for row in fetch_all(query, (pattern, limit, offset), kind='title')]
     except mysql.connector.Error as err:
         print(f"Error: {err}")
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+        return [], 0
+    return rows, _count("SELECT COUNT(*) FROM film WHERE title LIKE %s;", (pattern,))
+
 
+# One page of actors by name and the total number of matches
+def actors_by_name_page(actor_name: str, offset: int = 0, limit: int = 10) -> tuple:
+    if actor_index is not None:
+        matches = _search_matches('actor', actor_name, actor_index.search)
+        return matches[offset:offset + limit], len(matches)
 
-# Getting list of movies by actor and sending the actor to the query database
-def movies_by_actor(actor_id: str):
+    query = """
+        SELECT 
+            actor_id, first_name, last_name
+        FROM
+            actor
+        WHERE
+            first_name LIKE %s or last_name LIKE %s
+        ORDER BY actor_id
+        LIMIT %s OFFSET %s;
+    """
+    pattern = f"%{actor_name}%"
+    try:
+        rows = [ActorRow(*row) for row in fetch_all(query, (pattern, pattern, limit, offset), kind='actor')]
+    except mysql.connector.Error as err:
+        print(f"Error: {err}")
+        return [], 0
+    return rows, _count("SELECT COUNT(*) FROM actor WHERE first_name LIKE %s or last_name LIKE %s;", (pattern, pattern))
+
+
+# One page of an actor's movies as (actor, movies, total)
+def movies_by_actor_page(actor_id: str, offset: int = 0, limit: int = 10) -> tuple:
     query = """
         SELECT 
             film.film_id, title, release_year
@@ -289,7 +605,9 @@ def movies_by_actor(actor_id: str):
                 JOIN
             film_actor ON film.film_id = film_actor.film_id
         WHERE
-            actor_id = %s;
+            actor_id = %s
+        ORDER BY film.film_id
+        LIMIT %s OFFSET %s;
     """
     actor_query = """
         SELECT 
@@ -300,180 +618,451 @@ def movies_by_actor(actor_id: str):
             actor_id = %s;
     """
 
+    if actor_index is not None and actor_films is not None:
+        actor = actor_index.rows.get(int(actor_id))
+        if actor is None:
+            return None, [], 0
+        film_ids = actor_films.get(actor.actor_id, ())
+        films = (film_catalog.get(film_id) for film_id in film_ids[offset:offset + limit])
+        movies = [FilmRow(film.film_id, film.title, film.release_year) for film in films if film is not None]
+        total = len(film_ids)
+    else:
+        try:
+            movies = [FilmRow(*row) for row in fetch_all(query, (actor_id, limit, offset), kind='actor')]
+            row = fetch_one(actor_query, (actor_id,), kind='actor')
+        except mysql.connector.Error as err:
+            print(f"MySQL Error: {err}")
+            return None, [], 0
+
+        if row is None:
+            return None, [], 0
+        actor = ActorRow(*row)
+        total = _count("SELECT COUNT(*) FROM film_actor WHERE actor_id = %s;", (actor_id,))
+
+    return actor, movies, total
+
+
+
+# Export statements: every movie of a category, a year or an actor, one row per film and category
+EXPORT_COLUMNS = ("film_id", "title", "release_year", "category", "length", "rating")
+_EXPORT_SELECT = """
+    SELECT 
+        film.film_id, title, release_year, category.name, length, rating
+    FROM
+        film
+            JOIN
+        film_category ON film.film_id = film_category.film_id
+            JOIN
+        category ON film_category.category_id = category.category_id
+"""
+EXPORT_QUERIES = {
+    'category': _EXPORT_SELECT + " WHERE film_category.category_id = %s ORDER BY release_year, film.film_id;",
+    'year': _EXPORT_SELECT + " WHERE release_year = %s ORDER BY category.name, film.film_id;",
+    'actor': _EXPORT_SELECT + """ JOIN film_actor ON film.film_id = film_actor.film_id
+        WHERE film_actor.actor_id = %s ORDER BY film.film_id;""",
+}
+
+
+# Streaming the movies of a category, year or actor into `file` as gzip CSV or JSON lines.
+# The default mysql.connector cursor is unbuffered, so rows come from the server
+# EXPORT_BATCH_SIZE at a time and are never all in memory. Returns the row count, None on errors
+def export_movies(kind: str, key: str, fmt: str, file) -> Optional[int]:
     try:
-        connection = connect_db()
-        cursor = connection.cursor()
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            try:
+                start = time.perf_counter()
+                cursor.execute(EXPORT_QUERIES[kind], (key,))
+                try:
+                    count = write_export(file, EXPORT_COLUMNS, stream_rows(cursor, EXPORT_BATCH_SIZE), fmt, EXPORT_BATCH_SIZE)
+                finally:
+                    # Unread rows would block the connection when it goes back to the pool
+                    for _ in stream_rows(cursor, EXPORT_BATCH_SIZE):
+                        pass
+            finally:
+                cursor.close()
+            metrics.observe("sql", "export", time.perf_counter() - start)
+    except mysql.connector.Error as err:
+        print(f"Error: {err}")
+        return None
+    return count
+
+
+
+FILM_DETAILS_QUERY = """
+    SELECT 
+        film.film_id,
+        title,
+        release_year,
+        description,
+        category.category_id,
+        name,
+        length,
+        CASE rating
+            WHEN 'G' THEN 'General Audiences'
+            WHEN 'PG' THEN 'Parental Guidance Suggested'
+            WHEN 'PG-13' THEN 'Parents Strongly Cautioned'
+            WHEN 'R' THEN 'Restricted'
+            ELSE 'Adults Only'
+        END AS rating
+    FROM
+        film
+            JOIN
+        film_category ON film.film_id = film_category.film_id
+            JOIN
+        category ON film_category.category_id = category.category_id
+"""
+
+# Details of every film by film_id, loaded at startup
+film_catalog = None
 
-        # Получаем фильмы
-        cursor.execute(query, (actor_id,))
-        movies = cursor.fetchall()
 
-        # Сохраняем в файл
-        result_str = '\n'.join(f"[{row[0]:4}] {row[1]}, {row[2]}" for row in movies)
-        with open('movies_by_actor.txt', 'w') as file:
-            file.write(result_str)
+# Getting detailed information about a movie by ID number and sending the movie to the query database
+def movie_by_id(movie_id: str) -> Optional[FilmDetails]:
+    if film_catalog is not None:
+        movie = film_catalog.get(int(movie_id))
+    else:
+        try:
+            row = fetch_one(FILM_DETAILS_QUERY + " WHERE film.film_id = %s;", (movie_id,), kind='movie')
+        except mysql.connector.Error as err:
+            print(f"MySQL Error: {err}")
+            return None
+        movie = FilmDetails(*row) if row is not None else None
+
+    if movie is None:
+        return None
+
+    # MongoDB
+    insert_movie(
+        film_id=movie.film_id,
+        title=movie.title,
+        release_year=movie.release_year,
+        description=movie.description,
+        category_id=movie.category_id,
+        category_name=movie.category_name,
+        length=movie.length,
+        rating=movie.rating
+    )
 
-        # Получаем данные об актёре
-        cursor.execute(actor_query, (actor_id,))
-        actor = cursor.fetchone()
-        actor_id, first_name, last_name = actor
+    return movie
 
-        # MongoDB
-        insert_actor(actor_id, first_name, last_name)
 
-    except mysql.connector.Error as err:
-        print(f"MySQL Error: {err}")
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
-    return first_name, last_name
+# Building the film catalog and search indexes from catalog rows
+def set_catalog(categories: list, films: list, actors: list, film_actors: list) -> FilmCatalog:
+    global film_catalog, title_index, actor_index, actor_films
+    catalog = FilmCatalog(films)
+    films_by_actor = {}
+    for actor_id, film_id in film_actors:
+        films_by_actor.setdefault(actor_id, []).append(film_id)
 
+    _set_categories(categories)
+    title_index = TrigramIndex([FilmRow(film.film_id, film.title, film.release_year) for film in catalog.films.values()])
+    actor_index = ActorIndex(actors)
+    actor_films = {actor_id: tuple(sorted(film_ids)) for actor_id, film_ids in films_by_actor.items()}
+    film_catalog = catalog
+    return catalog
 
 
+# Held while load_catalog() runs (the background load after a snapshot warm start, or a retry)
+_catalog_loading = threading.Lock()
 
 
+# Loading the catalog from MySQL and saving it as the local snapshot
+def load_catalog() -> Optional[FilmCatalog]:
+    with _catalog_loading:
+        return _load_catalog()
 
-# Getting detailed information about a movie by ID number and sending the movie to the query database
-def movie_by_id(movie_id: str):
-    query = """
-        SELECT 
-            film.film_id,
-            title,
-            release_year,
-            description,
-            category.category_id,
-            name,
-            length,
-            CASE rating
-                WHEN 'G' THEN 'General Audiences'
-                WHEN 'PG' THEN 'Parental Guidance Suggested'
-                WHEN 'PG-13' THEN 'Parents Strongly Cautioned'
-                WHEN 'R' THEN 'Restricted'
-                ELSE 'Adults Only'
-            END AS rating
-        FROM
-            film
-                JOIN
-            film_category ON film.film_id = film_category.film_id
-                JOIN
-            category ON film_category.category_id = category.category_id
-        WHERE
-            film.film_id = %s;
-    """
 
+def _load_catalog() -> Optional[FilmCatalog]:
     try:
-        connection = connect_db()
-        cursor = connection.cursor()
-        cursor.execute(query, (movie_id,))
-        movie = cursor.fetchone()
-
-        film_id, title, release_year, description, category_id, category_name, length, rating = movie
-
-        # Сохраняем в файл
-        result_str = f"""Film ID: [{film_id}]
-Title: {title}
-Release year: {release_year}
-Description: {description}
-Category: {category_name}
-Length: {length}
-Rating: {rating}"""
-        with open('movie_details.txt', 'w') as file:
-            file.write(result_str)
-
-        # MongoDB
-        insert_movie(
-            film_id=film_id,
-            title=title,
-            release_year=release_year,
-            description=description,
-            category_id=category_id,
-            category_name=category_name,
-            length=length,
-            rating=rating
-        )
-
+        # Read the watermarks first, so rows changed while loading are picked up by the next refresh
+        watermarks = {table: _latest_key(table) for table in DELTA_QUERIES}
+        categories = category_list()
+        films = [FilmDetails(*row) for row in fetch_all(FILM_DETAILS_QUERY + " ORDER BY film.film_id;")]
+        actors = [ActorRow(*row) for row in fetch_all("SELECT actor_id, first_name, last_name FROM actor;")]
+        film_actors = fetch_all("SELECT actor_id, film_id FROM film_actor;")
     except mysql.connector.Error as err:
-        print(f"MySQL Error: {err}")
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
-
-
+        print(f"Error: {err}")
+        return None
 
+    catalog = set_catalog(categories, films, actors, film_actors)
+    _watermarks.update(watermarks)
+    _save_snapshot(categories, films, actors, film_actors)
+    return catalog
 
 
-# Getting the most popular queries by movies
-def queries_by_movies():
-    db = connect_mongo()
-    collection = db["movie"]
+def _save_snapshot(categories: list, films: list, actors: list, film_actors: list):
+    try:
+        write_snapshot(SNAPSHOT_PATH, categories, films, actors, film_actors)
+    except OSError as e:
+        print(f"Could not write snapshot {SNAPSHOT_PATH}: {e}")
 
-    top_movies = collection.find().sort("count", -1).limit(10)
 
-    result_str = '\n'.join(
-        f"{i+1:2}. [{doc['film_id']}] {doc['title']}, {doc['release_year']} - {doc['count']}"
-        for i, doc in enumerate(top_movies)
-    )
-
-    with open('queries_by_movies.txt', 'w') as file:
-        file.write(result_str)
+# Modification time of the snapshot file last loaded
+_snapshot_mtime = None
 
 
+# Loading the catalog from the local snapshot; None when there is no snapshot yet
+def load_snapshot() -> Optional[FilmCatalog]:
+    global _snapshot_mtime
+    try:
+        mtime = os.stat(SNAPSHOT_PATH).st_mtime_ns
+    except OSError:
+        return None
+    snapshot = read_snapshot(SNAPSHOT_PATH, CategoryRow, FilmDetails, ActorRow)
+    if snapshot is None:
+        return None
+    _snapshot_mtime = mtime
+    return set_catalog(snapshot["categories"], snapshot["films"], snapshot["actors"], snapshot["film_actors"])
+
+
+# Worker mode: only worker 0 reads MySQL (load_catalog, refresh_catalog) and rewrites the snapshot
+# when the catalog changes; the other workers reload the file when it is newer than theirs.
+# Returns True when the catalog was reloaded
+def reload_snapshot() -> bool:
+    try:
+        mtime = os.stat(SNAPSHOT_PATH).st_mtime_ns
+    except OSError:
+        return False
+    if mtime == _snapshot_mtime or load_snapshot() is None:
+        return False
+    result_cache.invalidate()
+    return True
+
+
+
+# Primary key of every table the catalog is built from, and the columns a refresh reads.
+# The key columns lead every delta row, last_update ends it
+DELTA_KEYS = {
+    "category": ("category_id",),
+    "film": ("film_id",),
+    "film_category": ("film_id", "category_id"),
+    "actor": ("actor_id",),
+    "film_actor": ("actor_id", "film_id"),
+}
+DELTA_COLUMNS = {
+    "category": "category_id, name",
+    "film": "film_id",
+    "film_category": "film_id, category_id",
+    "actor": "actor_id, first_name, last_name",
+    "film_actor": "actor_id, film_id",
+}
+
+
+# Rows after a (last_update, primary key) watermark in that order, so a poll does not re-read
+# rows it already applied, even when many rows share the watermark second (all of Sakila's
+# seed data does). A transaction committing late can still add rows to the watermark second
+# with a lower key, so while that second is less than DELTA_LOOKBACK seconds old by the
+# server's clock, the whole second is read again (DELTA_RECENT_QUERIES); applying rows twice
+# is harmless. Deleted rows are only dropped by load_catalog()
+def _delta_query(table: str) -> str:
+    key = ", ".join(DELTA_KEYS[table])
+    placeholders = ", ".join(["%s"] * (len(DELTA_KEYS[table]) + 1))
+    return (f"SELECT {DELTA_COLUMNS[table]}, last_update FROM {table} "
+            f"WHERE (last_update, {key}) > ({placeholders}) ORDER BY last_update, {key};")
+
+
+def _recent_delta_query(table: str) -> str:
+    key = ", ".join(DELTA_KEYS[table])
+    return (f"SELECT {DELTA_COLUMNS[table]}, last_update FROM {table} "
+            f"WHERE last_update >= %s ORDER BY last_update, {key};")
+
+
+DELTA_QUERIES = {table: _delta_query(table) for table in DELTA_KEYS}
+DELTA_RECENT_QUERIES = {table: _recent_delta_query(table) for table in DELTA_KEYS}
+
+# Watermark of an empty table: before any row
+_EMPTY_WATERMARK = "1970-01-01 00:00:00"
+
+
+# The (last_update, primary key) of a table's newest row
+def _latest_key(table: str) -> tuple:
+    key = ", ".join(f"{column} DESC" for column in DELTA_KEYS[table])
+    row = fetch_one(f"SELECT last_update, {', '.join(DELTA_KEYS[table])} FROM {table} "
+                    f"ORDER BY last_update DESC, {key} LIMIT 1;")
+    if row is None:
+        return (_EMPTY_WATERMARK,) + (0,) * len(DELTA_KEYS[table])
+    return tuple(row)
+
+
+# (last_update, primary key) of the last row applied per table; empty until load_catalog() has run
+_watermarks = {}
+
+
+# Applying rows changed since the last watermarks to the catalog, indexes and caches.
+# Returns the names of the tables that had real changes. Until a full load has succeeded
+# (MySQL was down at startup) every call retries load_catalog() instead, unless one is running
+def refresh_catalog() -> list:
+    if not _watermarks or film_catalog is None:
+        if _catalog_loading.locked() or load_catalog() is None:
+            return []
+        result_cache.invalidate()
+        return list(DELTA_QUERIES)
+    try:
+        cutoff = fetch_one("SELECT NOW() - INTERVAL %s SECOND;", (DELTA_LOOKBACK,))[0]
+        deltas = {}
+        for table, watermark in _watermarks.items():
+            if watermark[0] != _EMPTY_WATERMARK and watermark[0] >= cutoff:
+                deltas[table] = fetch_all(DELTA_RECENT_QUERIES[table], watermark[:1])
+            else:
+                deltas[table] = fetch_all(DELTA_QUERIES[table], watermark)
+        deltas = {table: rows for table, rows in deltas.items() if rows}
+        if not deltas:
+            return []
+
+        categories = {category.category_id: category for category in _categories}
+        changed_categories = set()
+        for category_id, name, _ in deltas.get("category", []):
+            if category_id not in categories or categories[category_id].name != name:
+                categories[category_id] = CategoryRow(category_id, name)
+                changed_categories.add(category_id)
+
+        # Films whose details may differ: edited films, recategorized films, films in renamed categories
+        film_ids = {row[0] for row in deltas.get("film", []) + deltas.get("film_category", [])}
+        film_ids.update(film.film_id for film in film_catalog.films.values() if film.category_id in changed_categories)
+        fetched = []
+        if film_ids:
+            placeholders = ', '.join(['%s'] * len(film_ids))
+            query = FILM_DETAILS_QUERY + f" WHERE film.film_id IN ({placeholders}) ORDER BY film.film_id;"
+            fetched = [FilmDetails(*row) for row in fetch_all(query, tuple(film_ids))]
+    except mysql.connector.Error as err:
+        print(f"Error: {err}")
+        return []
+
+    films = dict(film_catalog.films)
+    changed_films = []
+    for film in fetched:
+        if film.film_id in film_ids and films.get(film.film_id) != film:
+            changed_films.append(film)
+            films[film.film_id] = film
+        film_ids.discard(film.film_id)  # A film in several categories keeps its first one
+
+    actors = dict(actor_index.rows)
+    changed_actors = [ActorRow(*row[:3]) for row in deltas.get("actor", []) if actors.get(row[0]) != ActorRow(*row[:3])]
+    for actor in changed_actors:
+        actors[actor.actor_id] = actor
+
+    film_actors = {(actor_id, film_id) for actor_id, film_ids in actor_films.items() for film_id in film_ids}
+    new_film_actors = {(actor_id, film_id) for actor_id, film_id, _ in deltas.get("film_actor", [])} - film_actors
+    film_actors |= new_film_actors
+
+    for table, rows in deltas.items():  # Rows come in watermark order
+        _watermarks[table] = (rows[-1][-1],) + tuple(rows[-1][:len(DELTA_KEYS[table])])
+
+    changed = []
+    if changed_categories:
+        changed.append("category")
+    if changed_films:
+        changed.append("film")
+    if changed_actors:
+        changed.append("actor")
+    if new_film_actors:
+        changed.append("film_actor")
+    if not changed:
+        return []
+
+    categories = sorted(categories.values())
+    films = sorted(films.values())
+    actors = sorted(actors.values())
+    film_actors = sorted(film_actors)
+    set_catalog(categories, films, actors, film_actors)
+
+    # Drop cached SQL results that may show the old rows
+    if changed_categories or changed_films:
+        for kind in ('category', 'year', 'count', 'title', 'movie'):
+            result_cache.invalidate(kind)
+    if changed_actors or new_film_actors:
+        result_cache.invalidate('actor')
+        result_cache.invalidate('count')
+
+    _save_snapshot(categories, films, actors, film_actors)
+    return changed
+
+
+
+# Seeding the leaderboards from the query database. Returns False when MongoDB could not be
+# read; the leaderboards then keep what they have (empty at startup)
+def load_leaderboards() -> bool:
+    db = connect_mongo()
+    for collection_name, key in MONGO_KEYS.items():
+        entries = []
+        try:
+            with metrics.timer("mongo", f"{collection_name}.find"):
+                docs = list(db[collection_name].find({}, {"_id": 0}))
+        except PyMongoError as e:
+            print(f"Could not load the {collection_name} leaderboard: {e}")
+            return False
+        for doc in docs:
+            key_value = doc.pop(key)
+            count = doc.pop("count", 0)
+            entries.append((key_value, count, doc))
+        leaderboards[collection_name].load(entries)
+    return True
+
+
+# Reloading the leaderboards from MongoDB after writing the clicks buffered here, so clicks
+# counted before a late startup seed are kept. In worker mode every worker adds only its own
+# clicks, so this also runs periodically to pick up the flushed clicks of all workers; clicks
+# buffered meanwhile show up again after the next flush and reload
+def reseed_leaderboards() -> bool:
+    query_counters.flush()
+    return load_leaderboards()
+
+
+# Comparing the leaderboards with MongoDB after a flush; returns the differences found.
+# Clicks that arrive while the check runs can show up as differences.
+def check_leaderboards() -> list:
+    query_counters.flush()
+    db = connect_mongo()
+    differences = []
+    for collection_name, key in MONGO_KEYS.items():
+        leaderboard = leaderboards[collection_name]
+        memory_top = leaderboard.top()
+        with metrics.timer("mongo", f"{collection_name}.find_top"):
+            mongo_top = list(db[collection_name].find({}, {"_id": 0, key: 1, "count": 1}).sort("count", -1).limit(leaderboard.size))
 
+        memory_counts = [count for _, count, _ in memory_top]
+        mongo_counts = [doc["count"] for doc in mongo_top]
+        if memory_counts != mongo_counts:
+            differences.append(f"{collection_name}: top counts {memory_counts} in memory, {mongo_counts} in MongoDB")
+        for doc in mongo_top:
+            if leaderboard.count(doc[key]) != doc["count"]:
+                differences.append(f"{collection_name} {doc[key]}: {leaderboard.count(doc[key])} in memory, {doc['count']} in MongoDB")
+    return differences
 
-# Getting the most popular queries by category
-def queries_by_category():
-    db = connect_mongo()
-    collection = db["category"]
 
-    top_categories = collection.find().sort("count", -1).limit(10)
 
-    result_str = '\n'.join(
-        f"{i+1:2}.  {doc['category_name']} - {doc['count']}"
-        for i, doc in enumerate(top_categories)
+# Getting the most popular queries by movies
+def queries_by_movies() -> str:
+    return '\n'.join(
+        f"{i+1:2}. [{film_id}] {fields['title']}, {fields['release_year']} - {count}"
+        for i, (film_id, count, fields) in enumerate(leaderboards["movie"].top())
     )
 
-    with open('queries_by_category.txt', 'w') as file:
-        file.write(result_str)
 
 
+# Getting the most popular queries by category
+def queries_by_category() -> str:
+    return '\n'.join(
+        f"{i+1:2}.  {fields['category_name']} - {count}"
+        for i, (_, count, fields) in enumerate(leaderboards["category"].top())
+    )
 
 
 
 # Getting the most popular queries by actors
-def queries_by_actors():
-    db = connect_mongo()
-    collection = db["actor"]
-
-    top_actors = collection.find().sort("count", -1).limit(10)
-
-    result_str = '\n'.join(
-        f"{i+1:2}.  {doc['first_name']} {doc['last_name']} - {doc['count']}"
-        for i, doc in enumerate(top_actors)
+def queries_by_actors() -> str:
+    return '\n'.join(
+        f"{i+1:2}.  {fields['first_name']} {fields['last_name']} - {count}"
+        for i, (_, count, fields) in enumerate(leaderboards["actor"].top())
     )
 
-    with open('queries_by_actors.txt', 'w') as file:
-        file.write(result_str)
-
-
-
 
 
 # Getting the most popular queries by year of release
-def queries_by_year():
-    db = connect_mongo()
-    collection = db["year"]
-
-    top_years = collection.find().sort("count", -1).limit(10)
-
-    result_str = '\n'.join(
-        f"{i+1:2}.  {doc['release_year']} - {doc['count']}"
-        for i, doc in enumerate(top_years)
+def queries_by_year() -> str:
+    return '\n'.join(
+        f"{i+1:2}.  {release_year} - {count}"
+        for i, (release_year, count, _) in enumerate(leaderboards["year"].top())
     )
-
-    with open('queries_by_year.txt', 'w') as file:
-        file.write(result_str)
-
-
@@ -0,0 +1,117 @@
+# Write-behind buffer and in-memory leaderboards for the query counters
+
+import heapq
+import threading
+
+
+# Collects counter increments in memory and writes them out in batches.
+# Repeated keys are coalesced, so a burst of clicks on one category becomes one update.
+# A background thread flushes when max_pending keys are buffered or every `interval` seconds.
+class CounterBuffer:
+    def __init__(self, write, max_pending: int = 500, interval: float = 5.0):
+        self.write = write  # write(batch) with batch = {collection: [(key, count, fields), ...]}
+        self.max_pending = max_pending
+        self.interval = interval
+        self.flushed_increments = 0
+        self.flushed_batches = 0
+        self._pending = {}  # (collection, key) -> [count, fields]
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def add(self, collection: str, key, fields: dict, count: int = 1):
+        if self._merge(collection, key, fields, count) >= self.max_pending:
+            self._wakeup.set()
+
+    def start(self):
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="counter_flush", daemon=True)
+            self._thread.start()
+
+    # Stopping the background thread and writing whatever is still buffered
+    def stop(self):
+        if self._thread is not None:
+            self._stopping = True
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        batch = {}
+        for (collection, key), (count, fields) in pending.items():
+            batch.setdefault(collection, []).append((key, count, fields))
+        try:
+            self.write(batch)
+        except Exception as e:
+            print(f"Counter flush failed, keeping {len(pending)} keys for the next try: {e}")
+            # Merge back without waking the thread, so a down server is retried on the interval
+            for (collection, key), (count, fields) in pending.items():
+                self._merge(collection, key, fields, count)
+            return
+        self.flushed_batches += 1
+        self.flushed_increments += sum(count for count, _ in pending.values())
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _merge(self, collection: str, key, fields: dict, count: int) -> int:
+        with self._lock:
+            entry = self._pending.get((collection, key))
+            if entry is None:
+                self._pending[(collection, key)] = [count, fields]
+            else:
+                entry[0] += count
+            return len(self._pending)
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+# Live counts for one dimension (movies, actors, ...) with the top entries kept ready to render.
+# Seeded from MongoDB at startup and incremented together with the write-behind buffer.
+class Leaderboard:
+    def __init__(self, size: int = 10):
+        self.size = size
+        self._counts = {}  # key -> [count, fields]
+        self._top = None  # Cached top entries, dropped on every change
+        self._lock = threading.Lock()
+
+    def load(self, entries):
+        counts = {key: [count, fields] for key, count, fields in entries}
+        with self._lock:
+            self._counts = counts
+            self._top = None
+
+    def increment(self, key, fields: dict, count: int = 1):
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry is None:
+                self._counts[key] = [count, fields]
+            else:
+                entry[0] += count
+            self._top = None
+
+    def count(self, key) -> int:
+        with self._lock:
+            entry = self._counts.get(key)
+            return entry[0] if entry else 0
+
+    # Top entries as (key, count, fields), highest count first
+    def top(self) -> list:
+        with self._lock:
+            if self._top is None:
+                largest = heapq.nlargest(self.size, self._counts.items(), key=lambda item: item[1][0])
+                self._top = [(key, count, fields) for key, (count, fields) in largest]
+            return self._top
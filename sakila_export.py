@@ -0,0 +1,50 @@
+# Streaming export of query results as gzip-compressed CSV or JSON lines.
+# Rows are read in batches and written as they arrive, so memory use does not grow with the result
+
+import csv
+import io
+import json
+import zlib
+
+FORMATS = ("csv", "jsonl")
+
+
+# Rows of an executed cursor, fetched `batch_size` at a time
+def stream_rows(cursor, batch_size: int = 1000):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+# Encoded lines for a batch of rows
+def _encode(columns: tuple, rows: list, fmt: str) -> str:
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+    return ''.join(json.dumps(dict(zip(columns, row)), default=str) + '\n' for row in rows)
+
+
+# Writing rows to a binary file as a gzip document; returns the number of rows written
+def write_export(file, columns: tuple, rows, fmt: str, batch_size: int = 1000) -> int:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip header and trailer
+    if fmt == "csv":
+        file.write(compressor.compress(_encode(columns, [columns], fmt).encode()))
+
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            file.write(compressor.compress(_encode(columns, batch, fmt).encode()))
+            count += len(batch)
+            batch = []
+    if batch:
+        file.write(compressor.compress(_encode(columns, batch, fmt).encode()))
+        count += len(batch)
+    file.write(compressor.flush())
+    return count
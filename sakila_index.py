@@ -0,0 +1,216 @@
+# In-memory search indexes over the Sakila catalog
+
+import sys
+from collections import Counter
+
+
+def normalize(text: str) -> str:
+    return ' '.join(text.lower().split())
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# Trigram inverted index for substring and fuzzy title search.
+# rows are records with film_id and title fields (FilmRow)
+class TrigramIndex:
+    def __init__(self, rows: list):
+        self.rows = list(rows)
+        self.titles = [normalize(row.title) for row in self.rows]
+        self.gram_counts = []
+        self.postings = {}  # trigram -> list of row positions, in ascending order
+        for position, title in enumerate(self.titles):
+            grams = trigrams(title)
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(position)
+
+    def __len__(self):
+        return len(self.rows)
+
+    # Titles containing the text, best first; when none do, titles sharing most trigrams with it
+    def search(self, text: str, limit: int = None, min_similarity: float = 0.3) -> list:
+        text = normalize(text)
+        if not text:
+            return []
+
+        grams = trigrams(text)
+        if not grams:
+            # Too short for trigrams: scan the normalized titles, still in memory
+            candidates = range(len(self.titles))
+        else:
+            postings = [self.postings.get(gram) for gram in grams]
+            if all(postings):
+                postings.sort(key=len)
+                candidates = set(postings[0])
+                for posting in postings[1:]:
+                    candidates.intersection_update(posting)
+                    if not candidates:
+                        break
+            else:
+                candidates = ()
+
+        matches = [position for position in candidates if text in self.titles[position]]
+        if matches:
+            # Whole title, then prefix, then earliest match, then alphabetical
+            matches.sort(key=lambda position: (
+                self.titles[position] != text,
+                self.titles[position].find(text),
+                self.titles[position],
+            ))
+        elif grams:
+            matches = self._fuzzy(grams, min_similarity)
+
+        if limit is not None:
+            matches = matches[:limit]
+        return [self.rows[position] for position in matches]
+
+    def _fuzzy(self, grams: set, min_similarity: float) -> list:
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        scored = []
+        for position, count in shared.items():
+            # Share of the text's trigrams found in the title: a typo in one word of a longer title
+            # scores as well as in a one-word title. Ties go to the closer title (Jaccard similarity)
+            similarity = count / len(grams)
+            if similarity >= min_similarity:
+                closeness = count / (len(grams) + self.gram_counts[position] - count)
+                scored.append((-similarity, -closeness, self.titles[position], position))
+        scored.sort()
+        return [position for _, _, _, position in scored]
+
+
+class _TrieNode:
+    __slots__ = ('children', 'ids')
+
+    def __init__(self):
+        self.children = {}
+        self.ids = set()
+
+
+# Name index for actor search: a trie over normalized first, last and full names,
+# a substring pass matching the old LIKE search, and an edit-distance fallback for typos.
+# rows are records with actor_id, first_name and last_name fields (ActorRow)
+class ActorIndex:
+    def __init__(self, rows: list):
+        self.rows = {row.actor_id: row for row in rows}
+        self.names = {row.actor_id: normalize(f"{row.first_name} {row.last_name}") for row in rows}
+        self.root = _TrieNode()
+        for actor_id, full_name in self.names.items():
+            for name in set(full_name.split()) | {full_name}:
+                self._insert(name, actor_id)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _insert(self, name: str, actor_id):
+        node = self.root
+        for char in name:
+            node = node.children.setdefault(char, _TrieNode())
+        node.ids.add(actor_id)
+
+    def _prefix_node(self, prefix: str):
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    # Ranked actor IDs: exact name, name prefix, substring, then closest spellings
+    def search_ids(self, text: str, limit: int = None) -> list:
+        text = normalize(text)
+        if not text:
+            return []
+
+        ranks = {}
+        node = self._prefix_node(text)
+        if node is not None:
+            for actor_id in node.ids:
+                ranks[actor_id] = 0
+            stack = list(node.children.values())
+            while stack:
+                node = stack.pop()
+                for actor_id in node.ids:
+                    ranks.setdefault(actor_id, 1)
+                stack.extend(node.children.values())
+        for actor_id, full_name in self.names.items():
+            if actor_id not in ranks and text in full_name:
+                ranks[actor_id] = 2
+
+        if ranks:
+            ordered = sorted(ranks, key=lambda actor_id: (ranks[actor_id], actor_id))
+        else:
+            ordered = self._fuzzy(text.split())
+        return ordered[:limit] if limit is not None else ordered
+
+    def search(self, text: str, limit: int = None) -> list:
+        return [self.rows[actor_id] for actor_id in self.search_ids(text, limit)]
+
+    # Actors matching most query words within a small edit distance, then by total distance
+    def _fuzzy(self, words: list) -> list:
+        scores = {}  # actor_id -> [matched words, total distance]
+        for word in words:
+            max_distance = 1 if len(word) <= 4 else 2
+            best = {}
+            for distance, ids in self._within(word, max_distance):
+                for actor_id in ids:
+                    if distance < best.get(actor_id, max_distance + 1):
+                        best[actor_id] = distance
+            for actor_id, distance in best.items():
+                score = scores.setdefault(actor_id, [0, 0])
+                score[0] += 1
+                score[1] += distance
+        return sorted(scores, key=lambda actor_id: (-scores[actor_id][0], scores[actor_id][1], actor_id))
+
+    # (distance, ids) of trie names within max_distance of word.
+    # Walks the trie with one Levenshtein row per node and prunes branches that can only get worse
+    def _within(self, word: str, max_distance: int) -> list:
+        found = []
+        first_row = list(range(len(word) + 1))
+        stack = [(child, char, first_row) for char, child in self.root.children.items()]
+        while stack:
+            node, char, previous = stack.pop()
+            row = [previous[0] + 1]
+            for i, word_char in enumerate(word, 1):
+                row.append(min(row[i - 1] + 1, previous[i] + 1, previous[i - 1] + (word_char != char)))
+            if row[-1] <= max_distance and node.ids:
+                found.append((row[-1], node.ids))
+            if min(row) <= max_distance:
+                stack.extend((child, next_char, row) for next_char, child in node.children.items())
+        return found
+
+
+# Film details by film_id, loaded once. Records are tuples (FilmDetails) and repeated
+# strings such as category names and ratings are shared, so each film costs one tuple.
+class FilmCatalog:
+    def __init__(self, rows: list):
+        shared = {}
+        self.films = {}
+        for row in rows:
+            if row.film_id in self.films:
+                continue  # A film in several categories keeps its first one
+            self.films[row.film_id] = row._replace(
+                category_name=shared.setdefault(row.category_name, row.category_name),
+                rating=shared.setdefault(row.rating, row.rating),
+            )
+
+    def __len__(self):
+        return len(self.films)
+
+    def get(self, film_id: int):
+        return self.films.get(film_id)
+
+    # Approximate resident size of the catalog in bytes, counting shared strings once
+    def memory_bytes(self) -> int:
+        seen = set()
+        size = sys.getsizeof(self.films)
+        for film_id, record in self.films.items():
+            size += sys.getsizeof(film_id) + sys.getsizeof(record)
+            for value in record:
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    size += sys.getsizeof(value)
+        return size
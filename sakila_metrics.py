@@ -0,0 +1,175 @@
+# Latency histograms for bot handlers, SQL statements and MongoDB operations,
+# exported in the Prometheus text format on a local HTTP endpoint
+
+import functools
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds of the histogram buckets in seconds; the last bucket is +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    # Estimated quantile in seconds, interpolated inside the bucket it falls in
+    def quantile(self, share: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = share * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return BUCKETS[-1]
+
+
+# Timing a block into a histogram: with metrics.timer("sql", "category"): ...
+class _Timer:
+    __slots__ = ('metrics', 'metric', 'label', 'start')
+
+    def __init__(self, metrics, metric: str, label: str):
+        self.metrics = metrics
+        self.metric = metric
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.metric, self.label, time.perf_counter() - self.start)
+        return False
+
+
+# Registry of histograms keyed by (metric, label). Recording is one bisect and three
+# increments under a lock, so it is cheap enough for every handler call and statement
+class Metrics:
+    def __init__(self, prefix: str = "sakila"):
+        self.prefix = prefix
+        self._metrics = {}  # metric -> (label name, help text)
+        self._histograms = {}  # (metric, label) -> Histogram
+        self._counters = {}  # counter -> (help text, function returning the current value)
+        self._lock = threading.Lock()
+
+    def describe(self, metric: str, label_name: str, help_text: str):
+        self._metrics[metric] = (label_name, help_text)
+
+    # Exporting a running total kept elsewhere (e.g. a cache's hit count)
+    def counter(self, name: str, help_text: str, value):
+        self._counters[name] = (help_text, value)
+
+    def observe(self, metric: str, label: str, seconds: float):
+        index = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            histogram = self._histograms.get((metric, label))
+            if histogram is None:
+                histogram = self._histograms[(metric, label)] = Histogram()
+            histogram.counts[index] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+
+    def timer(self, metric: str, label: str) -> _Timer:
+        return _Timer(self, metric, label)
+
+    # Wrapping an async handler so every call is timed under its function name
+    def timed(self, metric: str, func):
+        label = func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.observe(metric, label, time.perf_counter() - start)
+        return wrapper
+
+    # Copies of the histograms as sorted (metric, label, Histogram) tuples
+    def snapshot(self) -> list:
+        with self._lock:
+            items = sorted(self._histograms.items())
+            copies = []
+            for (metric, label), histogram in items:
+                copy = Histogram()
+                copy.counts = list(histogram.counts)
+                copy.sum = histogram.sum
+                copy.count = histogram.count
+                copies.append((metric, label, copy))
+        return copies
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+    # Prometheus text exposition format (version 0.0.4)
+    def render(self) -> str:
+        lines = []
+        described = set()
+        for metric, label, histogram in self.snapshot():
+            name = f"{self.prefix}_{metric}_seconds"
+            label_name, help_text = self._metrics.get(metric, ("name", metric))
+            if metric not in described:
+                described.add(metric)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+            label_value = label.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{label_name}="{label_value}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{label_name}="{label_value}"}} {histogram.sum:.6f}')
+            lines.append(f'{name}_count{{{label_name}="{label_value}"}} {histogram.count}')
+        for counter, (help_text, value) in sorted(self._counters.items()):
+            name = f"{self.prefix}_{counter}_total"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {value()}")
+        return '\n'.join(lines) + '\n'
+
+    # Plain-text table for the /stats command: calls, p50, p95 and p99 per label
+    def summary(self) -> str:
+        lines = []
+        current = None
+        for metric, label, histogram in self.snapshot():
+            if metric != current:
+                current = metric
+                lines.append(f"\n{metric}: calls  p50  p95  p99 (ms)")
+            lines.append(
+                f"{label}: {histogram.count}  {histogram.quantile(0.5) * 1000:.1f}  "
+                f"{histogram.quantile(0.95) * 1000:.1f}  {histogram.quantile(0.99) * 1000:.1f}"
+            )
+        return '\n'.join(lines).strip() or "No measurements yet."
+
+
+# Serving GET /metrics from a daemon thread; returns the server so it can be shut down
+def start_metrics_server(metrics: Metrics, host: str, port: int) -> ThreadingHTTPServer:
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            payload = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics_server", daemon=True).start()
+    return server
@@ -0,0 +1,165 @@
+# Outbound Telegram request scheduling: token buckets for the whole bot and for every chat,
+# a priority queue so replies to users go out before bulk sends, and waiting out retry_after
+# when Telegram still answers 429
+
+import asyncio
+import time
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+# Lower goes first. rate_limit_args=<priority> on ExtBot methods overrides the endpoint default.
+# Only requests to a chat are queued, so chat-less ones (answerCallbackQuery) need no entry
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_BULK = 2
+
+ENDPOINT_PRIORITIES = {
+    "sendMessage": PRIORITY_INTERACTIVE,
+    "editMessageText": PRIORITY_INTERACTIVE,
+    "sendDocument": PRIORITY_BULK,
+}
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # Seconds until a token is available (0 when one is available now)
+    def wait_time(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+# Rate limiter for the Application (ApplicationBuilder().rate_limiter(...)).
+# Requests to a chat wait in one queue and are released by a dispatcher task, highest priority
+# first among those whose chat bucket and the overall bucket have a token. Requests without a
+# chat (getMe, answerCallbackQuery, ...) only wait for a retry_after pause
+class SendScheduler(BaseRateLimiter):
+    def __init__(self, overall_rate: float = 30, overall_burst: float = 30, chat_rate: float = 1,
+                 chat_burst: float = 3, group_rate: float = 20 / 60, group_burst: float = 3,
+                 max_retries: int = 3):
+        self.overall = TokenBucket(overall_rate, overall_burst)
+        self.chat_limits = (chat_rate, chat_burst)
+        self.group_limits = (group_rate, group_burst)
+        self.max_retries = max_retries
+        self.sent = 0
+        self.retries = 0
+        self._chats = {}  # chat_id -> TokenBucket
+        self._queue = []  # (priority, sequence, chat_id, future)
+        self._sequence = 0
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._dispatcher = None
+
+    async def initialize(self):
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for _, _, _, future in self._queue:
+            future.cancel()
+        self._queue = []
+
+    def queued(self) -> int:
+        return len(self._queue)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        priority = rate_limit_args if isinstance(rate_limit_args, int) else ENDPOINT_PRIORITIES.get(endpoint, PRIORITY_DEFAULT)
+
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                await self._acquire(priority, chat_id)
+            await self._wait_for_pause()
+            try:
+                result = await callback(*args, **kwargs)
+                self.sent += 1
+                return result
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                if chat_id is not None:
+                    # Flood limits are per chat: empty the chat's bucket for retry_after seconds
+                    bucket = self._bucket(chat_id)
+                    bucket.wait_time(time.monotonic())
+                    bucket.tokens = min(bucket.tokens, 1 - (retry_after + 0.1) * bucket.rate)
+                else:
+                    self._paused_until = max(self._paused_until, time.monotonic() + retry_after + 0.1)
+                self._wakeup.set()
+
+    async def _wait_for_pause(self):
+        delay = self._paused_until - time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._paused_until - time.monotonic()
+
+    async def _acquire(self, priority: int, chat_id):
+        future = asyncio.get_running_loop().create_future()
+        self._sequence += 1
+        self._queue.append((priority, self._sequence, chat_id, future))
+        self._wakeup.set()
+        await future
+
+    def _bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # Drop buckets of chats that have been quiet long enough to be full again
+                now = time.monotonic()
+                for value in self._chats.values():
+                    value.wait_time(now)
+                self._chats = {key: value for key, value in self._chats.items() if value.tokens < value.capacity}
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = self._chats[chat_id] = TokenBucket(*(self.group_limits if is_group else self.chat_limits))
+        return bucket
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            self._queue = [entry for entry in self._queue if not entry[3].done()]
+            delay = None
+            if self._queue:
+                now = time.monotonic()
+                delay = max(self._paused_until - now, self.overall.wait_time(now))
+                if delay <= 0:
+                    delay = self._release(now)
+                    if delay == 0:
+                        continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    # Releasing the first waiting request, in priority order, whose chat has a token.
+    # Returns 0 after a release, else the seconds until some chat gets a token
+    def _release(self, now: float) -> float:
+        delay = None
+        for entry in sorted(self._queue, key=lambda entry: entry[:2]):
+            bucket = self._bucket(entry[2])
+            wait = bucket.wait_time(now)
+            if wait <= 0:
+                bucket.take()
+                self.overall.take()
+                self._queue.remove(entry)
+                entry[3].set_result(None)
+                return 0
+            delay = wait if delay is None else min(delay, wait)
+        return delay
@@ -0,0 +1,77 @@
+# Slow-query log: statements slower than a threshold, one JSON object per line in a
+# rotating local file, with the EXPLAIN plan captured once per statement shape
+
+import json
+import logging
+import re
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+_IN_LIST = re.compile(r"IN \((?:%s, )*%s\)", re.IGNORECASE)
+
+
+# Statement with whitespace collapsed and IN (%s, %s, ...) lists folded,
+# so the same query with a different number of IDs has one shape
+def statement_shape(query: str) -> str:
+    return _IN_LIST.sub("IN (...)", ' '.join(query.split()))
+
+
+class SlowQueryLog:
+    def __init__(self, path: str, threshold_ms: float, explain: bool = True,
+                 max_bytes: int = 5 * 1024 * 1024, backups: int = 3):
+        self.path = path
+        # Statements at least this long are logged; a negative threshold turns the log off
+        self.threshold = threshold_ms / 1000 if threshold_ms >= 0 else float("inf")
+        self.explain = explain
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.logged = 0
+        self._explained = set()  # Statement shapes whose plan is already in the log
+        self._lock = threading.Lock()
+        self._logger = None
+
+    # The log file is only opened when the first slow statement arrives
+    def _get_logger(self) -> logging.Logger:
+        with self._lock:
+            if self._logger is None:
+                logger = logging.getLogger(f"sakila.slow_queries.{id(self)}")
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backups,
+                                              encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.addHandler(handler)
+                self._logger = logger
+        return self._logger
+
+    # Logging a statement that took `seconds`; connection is the one it ran on, used for EXPLAIN
+    def record(self, connection, query: str, params: tuple, row_count: int, seconds: float):
+        shape = statement_shape(query)
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "ms": round(seconds * 1000, 1),
+            "rows": row_count,
+            "sql": shape,
+            "params": list(params),
+        }
+        if self.explain and shape.upper().startswith("SELECT"):
+            with self._lock:
+                first = shape not in self._explained
+                self._explained.add(shape)
+            if first:
+                entry["explain"] = self._explain_plan(connection, query, params)
+
+        self._get_logger().info(json.dumps(entry, default=str))
+        self.logged += 1
+
+    def _explain_plan(self, connection, query: str, params: tuple):
+        cursor = connection.cursor()
+        try:
+            cursor.execute("EXPLAIN " + query, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception as e:
+            return {"error": str(e)}
+        finally:
+            cursor.close()
@@ -0,0 +1,163 @@
+# Local binary snapshot of the Sakila catalog for a warm start
+#
+# Layout (little-endian):
+#   header   magic "SAKSNAP1", format version (uint16), created_at (float64), then for each
+#            section its offset and count
+#   sections fixed-size records; text fields are (offset, length) pairs into the string table
+#   strings  UTF-8 text of every distinct string, stored once
+#
+# The file is read through mmap and decoded with struct, without parsing any text format.
+# Missing numbers are stored as NULL_NUMBER, missing text as NULL_TEXT.
+# Files with another FORMAT_VERSION, or damaged ones, are ignored and rebuilt from MySQL.
+
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b"SAKSNAP1"
+FORMAT_VERSION = 2  # version 1 had no version field
+NULL_NUMBER = 0xFFFF
+NULL_TEXT = 0xFFFFFFFF
+
+SECTIONS = ("categories", "films", "actors", "film_actors", "strings")
+HEADER = struct.Struct("<8sHd" + "QI" * len(SECTIONS))
+RECORDS = {
+    # category_id, name
+    "categories": struct.Struct("<HII"),
+    # film_id, title, release_year, description, category_id, category_name, length, rating
+    "films": struct.Struct("<IIIHIIHIIHII"),
+    # actor_id, first_name, last_name
+    "actors": struct.Struct("<IIIII"),
+    # actor_id, film_id
+    "film_actors": struct.Struct("<II"),
+}
+
+
+class _StringTable:
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = {}
+
+    def add(self, text) -> tuple:
+        if text is None:
+            return NULL_TEXT, 0
+        if text not in self.offsets:
+            encoded = text.encode("utf-8")
+            self.offsets[text] = (len(self.data), len(encoded))
+            self.data += encoded
+        return self.offsets[text]
+
+
+def _number(value) -> int:
+    return NULL_NUMBER if value is None else value
+
+
+# Writing the catalog to `path` atomically (a temp file renamed over the old snapshot).
+# categories, films and actors are CategoryRow, FilmDetails and ActorRow records
+def write_snapshot(path: str, categories: list, films: list, actors: list, film_actors: list):
+    strings = _StringTable()
+    sections = {name: bytearray() for name in RECORDS}
+
+    for category in categories:
+        sections["categories"] += RECORDS["categories"].pack(category.category_id, *strings.add(category.name))
+    for film in films:
+        sections["films"] += RECORDS["films"].pack(
+            film.film_id, *strings.add(film.title), _number(film.release_year), *strings.add(film.description),
+            film.category_id, *strings.add(film.category_name), _number(film.length), *strings.add(film.rating)
+        )
+    for actor in actors:
+        sections["actors"] += RECORDS["actors"].pack(
+            actor.actor_id, *strings.add(actor.first_name), *strings.add(actor.last_name)
+        )
+    for actor_id, film_id in film_actors:
+        sections["film_actors"] += RECORDS["film_actors"].pack(actor_id, film_id)
+    sections["strings"] = strings.data
+
+    counts = {
+        "categories": len(categories), "films": len(films), "actors": len(actors),
+        "film_actors": len(film_actors), "strings": len(strings.data),
+    }
+    header = []
+    offset = HEADER.size
+    for name in SECTIONS:
+        header += [offset, counts[name]]
+        offset += len(sections[name])
+
+    temp_path = f"{path}.{os.getpid()}.tmp"  # several worker processes may write at once
+    with open(temp_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, time.time(), *header))
+        for name in SECTIONS:
+            file.write(sections[name])
+    os.replace(temp_path, path)
+
+
+# Reading a snapshot into record lists. Returns None when there is no usable snapshot.
+# make_category, make_film and make_actor build the row records from the decoded fields
+def read_snapshot(path: str, make_category, make_film, make_actor):
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return None
+
+    try:
+        with file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _read_sections(data, make_category, make_film, make_actor)
+    except (ValueError, struct.error, OSError) as e:
+        # Empty, truncated or otherwise damaged: treated like a missing snapshot
+        print(f"Ignoring snapshot {path}: {e}")
+        return None
+
+
+def _read_sections(data, make_category, make_film, make_actor) -> dict:
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a Sakila snapshot")
+    _, version, created_at, *header = HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"format version {version}, expected {FORMAT_VERSION}")
+    sections = {name: (header[2 * i], header[2 * i + 1]) for i, name in enumerate(SECTIONS)}
+    for name, (offset, count) in sections.items():
+        size = RECORDS[name].size if name in RECORDS else 1
+        if offset + count * size > len(data):
+            raise ValueError(f"truncated in the {name} section")
+
+    strings_offset, strings_length = sections["strings"]
+    strings = data[strings_offset:strings_offset + strings_length]
+    cache = {}
+
+    def text(offset: int, length: int):
+        if offset == NULL_TEXT:
+            return None
+        value = cache.get(offset)
+        if value is None:
+            value = cache[offset] = strings[offset:offset + length].decode("utf-8")
+        return value
+
+    def number(value: int):
+        return None if value == NULL_NUMBER else value
+
+    def records(name: str):
+        offset, count = sections[name]
+        size = RECORDS[name].size
+        return RECORDS[name].iter_unpack(data[offset:offset + count * size])
+
+    categories = [make_category(category_id, text(*name)) for category_id, *name in records("categories")]
+    films = [
+        make_film(film_id, text(t_off, t_len), number(year), text(d_off, d_len),
+                  category_id, text(c_off, c_len), number(length), text(r_off, r_len))
+        for film_id, t_off, t_len, year, d_off, d_len, category_id, c_off, c_len, length, r_off, r_len
+        in records("films")
+    ]
+    actors = [
+        make_actor(actor_id, text(f_off, f_len), text(l_off, l_len))
+        for actor_id, f_off, f_len, l_off, l_len in records("actors")
+    ]
+    film_actors = list(records("film_actors"))
+
+    return {
+        "created_at": created_at,
+        "categories": categories,
+        "films": films,
+        "actors": actors,
+        "film_actors": film_actors,
+    }
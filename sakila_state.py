@@ -0,0 +1,241 @@
+# Conversation state (context.user_data) kept outside the process, so it survives restarts
+# and can be shared by several bot workers.
+#
+# A store (MemoryStateStore, SQLiteStateStore) keeps one compact JSON text per user, and
+# StatePersistence plugs it into the Application (ApplicationBuilder().persistence(...)).
+# Writes are buffered and committed in one batch per persistence run, and each update re-reads
+# its user's row when another process changed it, so handlers always see the latest state.
+
+import asyncio
+import json
+import sqlite3
+import threading
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+# Search mode flags of handle_message, stored as the bits of one integer under "f"
+FLAG_KEYS = ('searching_actor', 'searching_title', 'expecting_actor_id', 'expecting_movie_id')
+
+
+# user_data as compact JSON text; empty state is stored as None (the row is dropped)
+def encode_state(data: dict):
+    state = {key: value for key, value in data.items() if key not in FLAG_KEYS}
+    flags = 0
+    for bit, key in enumerate(FLAG_KEYS):
+        if data.get(key):
+            flags |= 1 << bit
+    if flags:
+        state['f'] = flags
+    if not state:
+        return None
+    return json.dumps(state, separators=(',', ':'), ensure_ascii=False)
+
+
+def decode_state(text: str) -> dict:
+    state = json.loads(text)
+    flags = state.pop('f', 0)
+    for bit, key in enumerate(FLAG_KEYS):
+        state[key] = bool(flags & 1 << bit)
+    return state
+
+
+# Process-local store: state survives a restart of the Application, not of the process
+class MemoryStateStore:
+    def __init__(self):
+        self._rows = {}  # user_id -> text
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int):
+        return self._rows.get(user_id)
+
+    def load_all(self) -> dict:
+        with self._lock:
+            return dict(self._rows)
+
+    # Writing a batch of user_id -> text (None deletes the row)
+    def write_many(self, rows: dict):
+        with self._lock:
+            for user_id, text in rows.items():
+                if text is None:
+                    self._rows.pop(user_id, None)
+                else:
+                    self._rows[user_id] = text
+
+    def close(self):
+        pass
+
+
+# Embedded SQLite store in WAL mode: readers never block the writer, and several processes can
+# share one file. Every thread gets its own connection; a batch is one transaction
+class SQLiteStateStore:
+    def __init__(self, path: str, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS user_state (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000,
+                                         isolation_level=None, check_same_thread=False)
+            # NORMAL is durable in WAL mode except for the last commits before a power loss
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def get(self, user_id: int):
+        row = self._connection().execute("SELECT data FROM user_state WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def load_all(self) -> dict:
+        return dict(self._connection().execute("SELECT user_id, data FROM user_state"))
+
+    def write_many(self, rows: dict):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT INTO user_state (user_id, data) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET data = excluded.data",
+                [(user_id, text) for user_id, text in rows.items() if text is not None]
+            )
+            connection.executemany("DELETE FROM user_state WHERE user_id = ?",
+                                   [(user_id,) for user_id, text in rows.items() if text is None])
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            connection.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+# Persistence for user_data only; chat_data, bot_data, callback data and conversations are
+# not used by the handlers. PTB hands over the users changed since the last run every
+# update_interval seconds; they are written to the store in one batch
+class StatePersistence(BasePersistence):
+    def __init__(self, store, update_interval: float = 1):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True,
+                                                     callback_data=False),
+                         update_interval=update_interval)
+        self.store = store
+        self.flushes = 0
+        self.refreshes = 0
+        self._known = {}  # user_id -> text last read from or written to the store
+        self._pending = {}  # user_id -> text (None: delete) waiting for the next batch
+        self._writing = {}  # the batch being committed
+        self._flush_task = None
+
+    async def get_user_data(self) -> dict:
+        rows = await asyncio.to_thread(self.store.load_all)
+        self._known = dict(rows)
+        return {user_id: decode_state(text) for user_id, text in rows.items()}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_user_data(self, user_id: int, data: dict):
+        text = encode_state(data)
+        if text != self._known.get(user_id):
+            self._pending[user_id] = text
+            self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int):
+        self._pending[user_id] = None
+        self._schedule_flush()
+
+    # Called before every update: picking up state another worker wrote for this user.
+    # Users with unsaved local changes keep them. The lookup runs on a thread, because a WAL
+    # checkpoint or a writer holding the lock can block it for up to busy_timeout
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        if user_id in self._pending or user_id in self._writing:
+            return
+        text = await asyncio.to_thread(self.store.get, user_id)
+        if user_id in self._pending or user_id in self._writing:
+            return  # changed locally while the row was read
+        if text != self._known.get(user_id):
+            self.refreshes += 1
+            self._known[user_id] = text
+            user_data.clear()
+            if text is not None:
+                user_data.update(decode_state(text))
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name: str, key: tuple, new_state):
+        pass
+
+    # PTB calls update_user_data for all changed users at once; they are committed together
+    # once those calls have run
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        await asyncio.sleep(0)
+        await self._flush_pending()
+
+    async def _flush_pending(self):
+        while self._pending:
+            batch = self._writing = self._pending
+            self._pending = {}
+            try:
+                await asyncio.to_thread(self.store.write_many, batch)
+            except sqlite3.Error as e:
+                print(f"Error saving conversation state: {e}")
+                # Keeping the batch for the next run, unless newer state arrived meanwhile
+                self._pending = {**batch, **self._pending}
+                return
+            finally:
+                self._writing = {}
+            self._known.update(batch)
+            self.flushes += 1
+
+    # Waiting until every change handed over so far is in the store
+    async def write_pending(self):
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._flush_pending()
+
+    # Called by Application.shutdown after the last persistence run
+    async def flush(self):
+        await self.write_pending()
+        self.store.close()
@@ -0,0 +1,168 @@
+# Multi-process mode: the front process receives updates (polling or webhook) and routes each one
+# to one of N worker processes by a hash of its chat ID. Every update of a chat goes to the same
+# worker, which handles them in arrival order; updates of different chats run concurrently.
+#
+# Workers are started with the spawn method and build their own Application through
+# `app_factory(index, *args)`, an async context manager yielding an initialized, started
+# Application, so it must be a module-level function.
+
+import asyncio
+import logging
+import multiprocessing
+import queue
+import time
+import zlib
+
+from telegram import Update
+
+
+# Worker index for a chat; crc32 keeps the mapping the same across processes and restarts
+def shard_for(chat_id: int, workers: int) -> int:
+    return zlib.crc32(str(chat_id).encode()) % workers
+
+
+# The chat an update belongs to (its user for chat-less updates such as inline queries)
+def routing_key(update: Update) -> int:
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return 0
+
+
+class WorkerPool:
+    def __init__(self, workers: int, app_factory, *args, max_in_flight: int = 256):
+        self.workers = workers
+        self.app_factory = app_factory
+        self.args = args
+        self.max_in_flight = max_in_flight
+        self.routed = [0] * workers
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = []
+        self._processes = []
+        self._events = self._context.Queue()  # ("ready" | "drained", index, processed)
+        self.drained_at = None  # time.monotonic() when the last worker had handled everything
+
+    # Starting the workers and waiting until each has its Application running
+    def start(self, timeout: float = 120):
+        for index in range(self.workers):
+            updates = self._context.Queue()
+            process = self._context.Process(
+                target=worker_main, name=f"sakila_worker_{index}", daemon=True,
+                args=(index, updates, self._events, self.max_in_flight, self.app_factory, self.args)
+            )
+            process.start()
+            self._queues.append(updates)
+            self._processes.append(process)
+        ready, dead = self._collect(timeout)
+        if len(ready) < self.workers:
+            if dead:
+                reason = ", ".join(f"worker {index} exited with code {self._processes[index].exitcode}" for index in dead)
+            else:
+                reason = f"workers {sorted(set(range(self.workers)) - set(ready))} not ready after {timeout:.0f} s"
+            self._terminate()
+            raise RuntimeError(f"Worker pool did not start: {reason}")
+
+    # Routing an update as a dict (Update.to_dict()) to its chat's worker
+    def route(self, chat_id: int, data: dict):
+        index = shard_for(chat_id, self.workers)
+        self.routed[index] += 1
+        self._queues[index].put((chat_id, data))
+
+    # Forwarding updates from an Updater's queue until cancelled
+    async def forward(self, update_queue: asyncio.Queue):
+        while True:
+            update = await update_queue.get()
+            self.route(routing_key(update), update.to_dict())
+
+    # Letting the workers finish what they were sent; returns the updates each one processed
+    def stop(self, timeout: float = 60) -> list:
+        for updates in self._queues:
+            updates.put(None)
+        drained, dead = self._collect(timeout)
+        if dead:
+            logging.error(f"Workers {dead} exited before handling all their updates")
+        self.drained_at = time.monotonic()
+        for process in self._processes:
+            process.join(timeout)
+        self._terminate()
+        return [drained.get(index, 0) for index in range(self.workers)]
+
+    # Waiting for one event from every worker, polling so that a worker that exits without sending
+    # its event is noticed at once. Returns ({index: processed}, indexes of the workers that exited)
+    def _collect(self, timeout: float) -> tuple:
+        deadline = time.monotonic() + timeout
+        received = {}
+        while len(received) < self.workers:
+            try:
+                _, index, count = self._events.get(timeout=0.2)
+                received[index] = count
+                continue
+            except queue.Empty:
+                pass
+            dead = [index for index, process in enumerate(self._processes)
+                    if index not in received and not process.is_alive()]
+            if dead:
+                try:  # a worker that has just exited may still have its event on the way
+                    _, index, count = self._events.get(timeout=0.5)
+                    received[index] = count
+                    continue
+                except queue.Empty:
+                    return received, dead
+            if time.monotonic() >= deadline:
+                return received, []
+        return received, []
+
+    # Stopping every worker process that is still running
+    def _terminate(self):
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        self._queues = []
+        self._processes = []
+
+
+# Process entry point of a worker
+def worker_main(index: int, updates, events, max_in_flight: int, app_factory, args: tuple):
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    asyncio.run(_serve(index, updates, events, max_in_flight, app_factory, args))
+
+
+async def _serve(index: int, updates, events, max_in_flight: int, app_factory, args: tuple):
+    loop = asyncio.get_running_loop()
+    in_flight = asyncio.Semaphore(max_in_flight)
+    tails = {}  # chat_id -> task of the chat's latest update
+    processed = 0
+
+    async def process(app, previous, update: Update):
+        nonlocal processed
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            await app.process_update(update)
+        except Exception as e:
+            logging.error(f"Worker {index}: update {update.update_id} failed: {e}")
+        finally:
+            processed += 1
+            in_flight.release()
+
+    def forget(chat_id, task):
+        if tails.get(chat_id) is task:
+            del tails[chat_id]
+
+    async with app_factory(index, *args) as app:
+        events.put(("ready", index, 0))
+        logging.info(f"Worker {index} is running")
+        while True:
+            item = await loop.run_in_executor(None, updates.get)
+            if item is None:
+                break
+            chat_id, data = item
+            await in_flight.acquire()
+            task = asyncio.create_task(process(app, tails.get(chat_id), Update.de_json(data, app.bot)))
+            tails[chat_id] = task
+            task.add_done_callback(lambda task, chat_id=chat_id: forget(chat_id, task))
+        if tails:
+            await asyncio.wait(list(tails.values()))
+        events.put(("drained", index, processed))
@@ -0,0 +1,216 @@
+# Local load harness for webhook mode, no Telegram access needed
+#
+# 1. Start the fake Bot API and replay updates:
+#      python webhook_harness.py --updates updates.jsonl --concurrency 20
+# 2. Run the bot against it in webhook mode (in another shell):
+#      BOT_MODE=webhook WEBHOOK_SECRET=test PORT=8443 TELEGRAM_API_URL=http://127.0.0.1:8081/bot python main.py
+#
+# The harness waits for the bot to register its webhook, POSTs every update (one JSON object per
+# line in --updates, or synthetic /help commands) with the secret token header, and reports
+# POST latency plus end-to-end throughput measured by the replies arriving at the fake Bot API.
+
+import argparse
+import asyncio
+import email.policy
+import json
+import statistics
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+import httpx
+
+from sakila_ratelimit import TokenBucket
+
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Sakila", "username": "sakila_movies_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+# Methods whose calls count as a reply to an update
+REPLY_METHODS = {"sendMessage", "editMessageText", "sendDocument"}
+
+
+# Result of a Bot API method call: the bot user for getMe, a message for replies, True otherwise
+def api_result(method: str, params: dict):
+    if method == "getMe":
+        return BOT_USER
+    if method in REPLY_METHODS:
+        chat_id = int(params.get("chat_id", 0) or 0)
+        return {"message_id": 1, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", "")}
+    return True
+
+
+# Minimal Bot API: answers every method with a plausible result and records replies.
+# With limits, replies beyond Telegram-like flood limits get 429 with retry_after:
+# limits = (overall per second, per chat per second, per chat burst)
+class FakeBotAPI(ThreadingHTTPServer):
+    request_queue_size = 128  # bursts of concurrent replies would overflow the default backlog of 5
+
+    def __init__(self, address, limits: tuple = None):
+        super().__init__(address, _FakeBotAPIHandler)
+        self.replies = []  # (time, method, chat_id)
+        self.rejected = 0
+        self.webhook_set = threading.Event()
+        self.lock = threading.Lock()
+        self.limits = limits
+        if limits is not None:
+            self.overall = TokenBucket(limits[0], limits[0])
+            self.chats = {}
+
+    # Taking a token for a reply to chat_id; False when a flood limit is exceeded
+    def allow(self, chat_id: int) -> bool:
+        if self.limits is None:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            chat = self.chats.setdefault(chat_id, TokenBucket(self.limits[1], self.limits[2]))
+            if self.overall.wait_time(now) > 0 or chat.wait_time(now) > 0:
+                self.rejected += 1
+                return False
+            self.overall.take()
+            chat.take()
+            return True
+
+
+class _FakeBotAPIHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[-1]
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        params = _parse_params(body, self.headers.get("Content-Type", ""))
+
+        status = 200
+        response = {"ok": True, "result": api_result(method, params)}
+        if method in REPLY_METHODS:
+            chat_id = int(params.get("chat_id", 0) or 0)
+            if self.server.allow(chat_id):
+                with self.server.lock:
+                    self.server.replies.append((time.perf_counter(), method, chat_id))
+            else:
+                status = 429
+                response = {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                            "parameters": {"retry_after": 1}}
+        elif method == "setWebhook":
+            self.server.webhook_set.set()
+
+        payload = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _parse_params(body: bytes, content_type: str) -> dict:
+    if not body:
+        return {}
+    if "application/json" in content_type:
+        return json.loads(body)
+    if "application/x-www-form-urlencoded" in content_type:
+        return dict(parse_qsl(body.decode()))
+    if "multipart/form-data" in content_type:
+        # Uploads (sendDocument): the form fields, without the file contents
+        message = BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+        return {part.get_param("name", header="content-disposition"): part.get_content()
+                for part in message.iter_parts() if part.get_filename() is None}
+    return {}
+
+
+# Synthetic /help commands from `chats` different private chats
+def synthetic_updates(count: int, chats: int) -> list:
+    now = int(time.time())
+    updates = []
+    for update_id in range(1, count + 1):
+        chat_id = 1000 + update_id % chats
+        updates.append({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": now,
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+                "text": "/help",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 5}],
+            },
+        })
+    return updates
+
+
+def load_updates(path: str) -> list:
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+# Value at a share (0.95: p95) of sorted values; load_test.py uses it too
+def percentile(values: list, share: float) -> float:
+    return values[max(0, int(len(values) * share) - 1)]
+
+
+async def replay(url: str, secret: str, updates: list, concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        async def post(update: dict):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": secret})
+                timings.append(time.perf_counter() - start)
+                response.raise_for_status()
+
+        await asyncio.gather(*(post(update) for update in updates))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay updates against the bot's webhook")
+    parser.add_argument("--api-port", type=int, default=8081, help="Port of the fake Bot API")
+    parser.add_argument("--webhook", default="http://127.0.0.1:8443/telegram", help="Bot webhook URL")
+    parser.add_argument("--secret", default="test", help="WEBHOOK_SECRET the bot runs with")
+    parser.add_argument("--updates", help="JSON-lines file of recorded updates")
+    parser.add_argument("--count", type=int, default=1000, help="Synthetic updates when --updates is not given")
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for replies")
+    args = parser.parse_args()
+
+    updates = load_updates(args.updates) if args.updates else synthetic_updates(args.count, args.chats)
+
+    api = FakeBotAPI(("127.0.0.1", args.api_port))
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    print(f"Fake Bot API on http://127.0.0.1:{args.api_port}/bot, waiting for the bot to set its webhook...")
+    api.webhook_set.wait()
+    time.sleep(0.5)  # setWebhook is sent just before the webhook server starts listening
+
+    start = time.perf_counter()
+    timings = sorted(asyncio.run(replay(args.webhook, args.secret, updates, args.concurrency)))
+    posted = time.perf_counter() - start
+
+    deadline = time.monotonic() + args.timeout
+    while len(api.replies) < len(updates) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    replies = sorted(reply_time for reply_time, _, _ in api.replies)
+    api.shutdown()
+
+    print(f"POSTed {len(updates)} updates in {posted:.2f} s ({len(updates) / posted:.0f} updates/s)")
+    print(f"POST latency p50 {statistics.median(timings) * 1000:.1f} ms   "
+          f"p95 {percentile(timings, 0.95) * 1000:.1f} ms   p99 {percentile(timings, 0.99) * 1000:.1f} ms")
+    if replies:
+        handled = replies[-1] - start
+        print(f"{len(replies)} replies in {handled:.2f} s ({len(replies) / handled:.0f} replies/s)")
+    else:
+        print("No replies received")
+
+
+if __name__ == '__main__':
+    main()